@@ -0,0 +1,73 @@
+import re
+import sys
+import json
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "rplugin", "python3"))
+from airlatex import protocol
+
+
+# message loop before the dedicated frame parser
+codere = re.compile(r"(\d):(?:(\d+)(\+?))?:(?::(?:(\d+)(\+?))?(.*))?")
+def parseRegex(msg, loads):
+    code, await_id, await_mult, answer_id, answer_mult, data = codere.match(msg).groups()
+    if data:
+        data = loads(data)
+    return code, answer_id, data
+
+def parseIndex(msg, loads):
+    code, await_id, answer_id, data = protocol.parseFrame(msg)
+    if data:
+        data = loads(data)
+    return code, answer_id, data
+
+
+# typical traffic of a busy collaborative session
+def sampleFrames():
+    update = {"name": "otUpdateApplied", "args": [{"doc": "5f0c8b2e9d1a4c0017a3b2c1", "op": [{"p": 1234, "i": "x"}], "v": 42, "meta": {"source": "abc", "user_id": "def", "ts": 1600000000000}}]}
+    cursor = {"name": "clientTracking.clientUpdated", "args": [{"id": "abc", "user_id": "def", "name": "A", "doc_id": "5f0c8b2e9d1a4c0017a3b2c1", "row": 12, "column": 4}]}
+    joindoc = [None, ["\\section{Line %i} Lorem ipsum dolor sit amet, consectetur adipiscing elit." % i for i in range(2000)], 42, [], {}]
+    return [
+        "5:::" + json.dumps(update),
+        "5:::" + json.dumps(cursor),
+        "6:::7+[null]",
+        "2::",
+    ] * 250 + ["6:::3+" + json.dumps(joindoc)]
+
+
+def bench(name, parse, loads, frames, repeat=20):
+    start = perf_counter()
+    for _ in range(repeat):
+        for msg in frames:
+            parse(msg, loads)
+    duration = perf_counter() - start
+    rate = repeat * len(frames) / duration
+    print("%-28s %10.0f messages/s" % (name, rate))
+    return rate
+
+
+if __name__ == "__main__":
+    frames = sampleFrames()
+
+    # parsers need to agree
+    for msg in frames:
+        assert parseRegex(msg, json.loads) == parseIndex(msg, json.loads), msg
+
+    # frame parsing only
+    skip = lambda data: data
+    rate_regex = bench("regex", parseRegex, skip, frames)
+    rate_index = bench("parseFrame", parseIndex, skip, frames)
+    print("%-28s %10.2fx" % ("", rate_index / rate_regex))
+
+    # frame parsing & decoding
+    baseline = bench("regex + json", parseRegex, json.loads, frames)
+    for backend in protocol.json_backends:
+        try:
+            protocol.setJSONBackend(backend)
+        except ImportError:
+            continue
+        if protocol.json_backend != backend:
+            continue
+        rate = bench("parseFrame + %s" % backend, parseIndex, protocol.loads, frames)
+        print("%-28s %10.2fx" % ("", rate / baseline))
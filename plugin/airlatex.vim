@@ -40,6 +40,14 @@ if !exists("g:AirLatexLogFile")
 endif
 autocmd BufNewFile,BufRead AirLatex.log set filetype=airlatex_log
 
+if !exists("g:AirLatexLogMaxSize")
+    let g:AirLatexLogMaxSize=10
+endif
+
+if !exists("g:AirLatexLogBackups")
+    let g:AirLatexLogBackups=3
+endif
+
 if !exists("g:AirLatexUseHTTPS")
     let g:AirLatexUseHTTPS=1
 endif
@@ -52,6 +60,86 @@ if !exists("g:AirLatexWebsocketTimeout")
     let g:AirLatexWebsocketTimeout=10
 endif
 
+if !exists("g:AirLatexTrackChanges")
+    let g:AirLatexTrackChanges=1
+endif
+
+if !exists("g:AirLatexFlushDebounce")
+    let g:AirLatexFlushDebounce=300
+endif
+
+if !exists("g:AirLatexFlushMaxLatency")
+    let g:AirLatexFlushMaxLatency=1000
+endif
+
+if !exists("g:AirLatexCursorInterval")
+    let g:AirLatexCursorInterval=500
+endif
+
+if !exists("g:AirLatexLoadChunkSize")
+    let g:AirLatexLoadChunkSize=10000
+endif
+
+if !exists("g:AirLatexJSONBackend")
+    let g:AirLatexJSONBackend="auto"
+endif
+
+if !exists("g:AirLatexReconnectMaxDelay")
+    let g:AirLatexReconnectMaxDelay=60
+endif
+
+if !exists("g:AirLatexCompression")
+    let g:AirLatexCompression=6
+endif
+
+if !exists("g:AirLatexCompressionMemLevel")
+    let g:AirLatexCompressionMemLevel=8
+endif
+
+if !exists("g:AirLatexPrefetch")
+    let g:AirLatexPrefetch=0
+endif
+
+if !exists("g:AirLatexPrefetchMaxSize")
+    let g:AirLatexPrefetchMaxSize=512
+endif
+
+if !exists("g:AirLatexPrefetchConcurrency")
+    let g:AirLatexPrefetchConcurrency=2
+endif
+
+if !exists("g:AirLatexCache")
+    let g:AirLatexCache=1
+endif
+
+if !exists("g:AirLatexCacheDir")
+    let g:AirLatexCacheDir=""
+endif
+
+if !exists("g:AirLatexCacheMaxSize")
+    let g:AirLatexCacheMaxSize=100
+endif
+
+if !exists("g:AirLatexCacheMaxAge")
+    let g:AirLatexCacheMaxAge=30
+endif
+
+if !exists("g:AirLatexDownloadConcurrency")
+    let g:AirLatexDownloadConcurrency=4
+endif
+
+if !exists("g:AirLatexCompileOutputs")
+    let g:AirLatexCompileOutputs=["output.pdf", "output.log", "output.synctex.gz"]
+endif
+
+if !exists("g:AirLatexGrepConcurrency")
+    let g:AirLatexGrepConcurrency=4
+endif
+
+if !exists("g:AirLatexGrepIndex")
+    let g:AirLatexGrepIndex=0
+endif
+
 
 
 " vim: set sw=4 sts=4 et fdm=marker:
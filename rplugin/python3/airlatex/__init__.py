@@ -1,3 +1,4 @@
+import os
 import traceback
 import keyring
 import pynvim
@@ -8,6 +9,7 @@ from airlatex.sidebar import SideBar
 from airlatex.session import AirLatexSession
 from airlatex.documentbuffer import DocumentBuffer
 from airlatex.util import logging_settings, init_logger, __version__
+from airlatex.protocol import setJSONBackend
 
 
 
@@ -27,12 +29,16 @@ class AirLatex:
         # update user settings for logging
         logging_settings["level"]=self.nvim.eval("g:AirLatexLogLevel")
         logging_settings["file"]=self.nvim.eval("g:AirLatexLogFile")
+        logging_settings["max_size"]=self.nvim.eval("g:AirLatexLogMaxSize")
+        logging_settings["backups"]=self.nvim.eval("g:AirLatexLogBackups")
         log = init_logger()
         log.info("Starting AirLatex (Version %s)" % __version__)
         log.info("System Info:")
         log.info("  - Python Version: %i.%i" % (version_info.major, version_info.minor))
         log.info("  - OS: %s (%s)" % (platform.system(), platform.release()))
         self.log = log
+        backend = setJSONBackend(self.nvim.eval("g:AirLatexJSONBackend"))
+        log.info("  - JSON backend: %s", backend)
 
         # initialize exception handling for asyncio
         self.nvim.loop.set_exception_handler(self.asyncCatchException)
@@ -83,6 +89,96 @@ class AirLatex:
         self.nvim.command("call inputrestore()")
         keyring.set_password("airlatex_"+DOMAIN, username, self.nvim.eval("user_input"))
 
+    @pynvim.command('AirLatexStats', nargs=0, sync=True)
+    def showStats(self):
+        buffer = self.nvim.current.buffer
+        lines = []
+        if self.session:
+            lines += ["HTTP:"] + self.session.stats.format("  ") + self.session.http.stats.format("  ")
+            lines += ["Connections:"] + self.session.connections.format("  ")
+            if self.session.files.stats.entries:
+                lines += ["Files:"] + self.session.files.stats.format("  ")
+            if self.session.compiler.stats.entries:
+                lines += ["Compiles:"] + self.session.compiler.stats.format("  ")
+        if buffer in DocumentBuffer.allBuffers:
+            documentbuffer = DocumentBuffer.allBuffers[buffer]
+            lines += ["Document %s:" % documentbuffer.getName()] + documentbuffer.stats.format("  ")
+        if not lines:
+            self.nvim.out_write("AirLatexStats: current buffer is not an AirLatex document.\n")
+            return
+        self.nvim.out_write("\n".join(lines)+"\n")
+
+    # project of the current document (or the only connected project)
+    # (command is used for error messages, None for no messages)
+    def _currentProject(self, command=None):
+        if not self.session:
+            if command:
+                self.nvim.out_write("%s: not logged in.\n" % command)
+            return None
+        buffer = self.nvim.current.buffer
+        if buffer in DocumentBuffer.allBuffers:
+            return DocumentBuffer.allBuffers[buffer].project_handler
+        if len(self.session.connections.projects) == 1:
+            return list(self.session.connections.projects.values())[0]
+        if command:
+            self.nvim.out_write("%s: open a document of the project first.\n" % command)
+        return None
+
+    @pynvim.command('AirLatexMirror', nargs='?', complete='dir', sync=True)
+    def mirrorProject(self, args):
+        handler = self._currentProject("AirLatexMirror")
+        if handler is None:
+            return
+        directory = args[0] if args else os.path.join(self.nvim.funcs.getcwd(), handler.project["name"])
+        create_task(self.session.mirrorProject(handler, directory))
+
+    @pynvim.command('AirLatexGrep', nargs=1, sync=True)
+    def grepProject(self, args):
+        handler = self._currentProject("AirLatexGrep")
+        if handler is None:
+            return
+        create_task(self.session.grepProject(handler, args[0]))
+
+    @pynvim.command('AirLatexCompile', nargs=0, sync=True)
+    def compileProject(self):
+        handler = self._currentProject("AirLatexCompile")
+        if handler is None:
+            return
+
+        # send pending changes first (compiling waits until they are accepted)
+        for doc in handler.documents.values():
+            doc["buffer"].writeBuffer()
+        create_task(self.session.compileProject(handler))
+
+    @pynvim.command('AirLatexOpen', nargs=1, complete='customlist,AirLatex_CompleteDocument', sync=True)
+    def openDocument(self, args):
+        handler = self._currentProject("AirLatexOpen")
+        if handler is None:
+            return
+
+        # exact path or best match
+        doc = handler.index.byPath(args[0])
+        if doc is None or doc["type"] != "file":
+            matches = handler.index.find(args[0], limit=1)
+            if not matches:
+                self.nvim.out_write("AirLatexOpen: no document matches '%s'.\n" % args[0])
+                return
+            doc = handler.index.byPath(matches[0])
+
+        # already opened
+        if "buffer" in doc and doc["buffer"].buffer in DocumentBuffer.allBuffers:
+            self.nvim.command("buffer %i" % doc["buffer"].buffer.number)
+            return
+        documentbuffer = DocumentBuffer([handler.project] + handler.index.chain(doc["_id"]), self.nvim)
+        create_task(handler.joinDocument(documentbuffer))
+
+    @pynvim.function('AirLatex_CompleteDocument', sync=True)
+    def completeDocument(self, args):
+        handler = self._currentProject()
+        if handler is None:
+            return []
+        return handler.index.find(args[0], limit=50)
+
     @pynvim.function('AirLatex_SidebarRefresh', sync=False)
     def sidebarRefresh(self, args):
         if self.sidebar:
@@ -109,15 +205,36 @@ class AirLatex:
     @pynvim.function('AirLatex_Close', sync=True)
     def sidebarClose(self, args):
         if self.sidebar:
-            self.session.cleanup()
+            create_task(self.session.cleanup())
             self.sidebar = None
 
+    @pynvim.function('AirLatex_CursorMoved', sync=False)
+    def cursorMoved(self, args):
+        buffer = self.nvim.current.buffer
+        if buffer in DocumentBuffer.allBuffers:
+            DocumentBuffer.allBuffers[buffer].cursorMoved(args[0], args[1]-1)
+
     @pynvim.function('AirLatex_WriteBuffer', sync=True)
     def writeBuffer(self, args):
         buffer = self.nvim.current.buffer
         if buffer in DocumentBuffer.allBuffers:
             DocumentBuffer.allBuffers[buffer].writeBuffer()
 
+    @pynvim.rpc_export('nvim_buf_lines_event', sync=False)
+    def bufferLinesEvent(self, buffer, changedtick, firstline, lastline, linedata, more):
+        if buffer in DocumentBuffer.allBuffers:
+            DocumentBuffer.allBuffers[buffer].onLines(changedtick, firstline, lastline, linedata)
+
+    @pynvim.rpc_export('nvim_buf_changedtick_event', sync=False)
+    def bufferChangedtickEvent(self, buffer, changedtick):
+        if buffer in DocumentBuffer.allBuffers:
+            DocumentBuffer.allBuffers[buffer].onChangedtick(changedtick)
+
+    @pynvim.rpc_export('nvim_buf_detach_event', sync=False)
+    def bufferDetachEvent(self, buffer):
+        if buffer in DocumentBuffer.allBuffers:
+            DocumentBuffer.allBuffers[buffer].onDetach()
+
     def asyncCatchException(self, loop, context):
         message = context.get('message')
         if not message:
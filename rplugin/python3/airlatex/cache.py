@@ -0,0 +1,117 @@
+import os
+import re
+import json
+from time import time
+from asyncio import get_event_loop
+from logging import getLogger
+
+# ids of projects & documents (mongodb object ids)
+_object_id = re.compile(r"[0-9a-f]{24}")
+
+
+class SnapshotCache:
+
+    def __init__(self, directory, max_size=100, max_age=30, legacy_directory=None):
+        """
+        Snapshots of documents (lines & version) on disk, one file per document:
+            directory/project_id/doc_id.json
+        - a snapshot is the document exactly as known by the server at its version,
+          such that joining it from that version only replays the missing updates
+        - files are written in the executor (atomically, via rename)
+        - snapshots older than max_age days are removed, then the oldest ones until
+          the cache is smaller than max_size megabytes
+        - snapshots found in legacy_directory/project_id/ (the layout before the file cache
+          shared the directory) are moved to directory when evicting
+        """
+        self.directory = os.path.expanduser(directory)
+        self.legacy_directory = os.path.expanduser(legacy_directory) if legacy_directory else None
+        self.max_size = max_size * 1024 * 1024
+        self.max_age = max_age * 24 * 3600
+        self.log = getLogger("AirLatex")
+
+    def _path(self, project_id, doc_id):
+        return os.path.join(self.directory, project_id, doc_id + ".json")
+
+    def _write(self, path, snapshot):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def _read(self, path):
+        try:
+            with open(path, encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+    # move snapshots of the previous layout (newer snapshots of the same document win)
+    def _migrate(self):
+        if self.legacy_directory is None or not os.path.isdir(self.legacy_directory):
+            return
+        for project_id in os.listdir(self.legacy_directory):
+            old = os.path.join(self.legacy_directory, project_id)
+            if not _object_id.fullmatch(project_id) or not os.path.isdir(old):
+                continue
+            for name in os.listdir(old):
+                if not name.endswith(".json") or not _object_id.fullmatch(name[:-len(".json")]):
+                    continue
+                path = os.path.join(self.directory, project_id, name)
+                try:
+                    if os.path.exists(path):
+                        os.remove(os.path.join(old, name))
+                    else:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        os.replace(os.path.join(old, name), path)
+                except OSError as e:
+                    self.log.info("Could not move snapshot %s: %s", name, e)
+            try:
+                os.rmdir(old)
+            except OSError:
+                pass
+
+
+    # --- #
+    # api #
+    # --- #
+
+    async def load(self, project_id, doc_id):
+        snapshot = await get_event_loop().run_in_executor(None, self._read, self._path(project_id, doc_id))
+        if snapshot is None or time() - snapshot.get("saved", 0) > self.max_age:
+            return None
+        return snapshot
+
+    async def store(self, project_id, doc_id, lines, version):
+        snapshot = {"version": version, "lines": lines, "saved": time()}
+        path = self._path(project_id, doc_id)
+        try:
+            await get_event_loop().run_in_executor(None, self._write, path, snapshot)
+        except OSError as e:
+            self.log.info("Could not write snapshot %s: %s", path, e)
+
+    def evict(self):
+        self._migrate()
+        now = time()
+        files = sorted(self._files(), key=lambda f: f[1])
+        size = sum(f[2] for f in files)
+        for path, mtime, fsize in files:
+            if now - mtime <= self.max_age and size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                size -= fsize
+            except OSError:
+                pass
+        return size
@@ -0,0 +1,127 @@
+import os
+import json
+from time import perf_counter
+from asyncio import gather, get_event_loop
+from logging import getLogger
+from airlatex.files import streamToFile
+from airlatex.util import Stats
+
+
+class ProjectCompiler:
+
+    def __init__(self, session, directory, outputs=("output.pdf", "output.log", "output.synctex.gz")):
+        """
+        Triggers compiles on the server & retrieves their output files:
+        - compiles are requested via POST /project/<id>/compile (through the authenticated http session)
+        - output files listed in outputs are streamed to directory/<project_id>/ (in parallel)
+        - the build id (or hash) of every output is kept in directory/<project_id>/builds.json,
+          outputs that did not change since the last download are skipped
+        - compile & download timings are recorded in stats
+        """
+        self.session = session
+        self.directory = os.path.expanduser(directory)
+        self.outputs = outputs
+        self.stats = Stats()
+        self.log = getLogger("AirLatex")
+
+
+    # ------- #
+    # helpers #
+    # ------- #
+
+    def _buildsPath(self, project_id):
+        return os.path.join(self.directory, project_id, "builds.json")
+
+    def _readBuilds(self, project_id):
+        try:
+            with open(self._buildsPath(project_id), encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _writeBuilds(self, project_id, builds):
+        path = self._buildsPath(project_id)
+        with open(path + ".tmp", "w", encoding="utf8") as f:
+            json.dump(builds, f)
+        os.replace(path + ".tmp", path)
+
+    # runs in the executor
+    def _compile(self, project):
+        data = {
+            "rootDoc_id": project.get("rootDoc_id"),
+            "draft": False,
+            "check": "silent",
+            "incrementalCompilesEnabled": True,
+        }
+        headers = {"X-Csrf-Token": self.session.csrf} if self.session.csrf else {}
+        response = self.session.httpHandler.post(self.session.url + "/project/%s/compile" % project["id"], json=data, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    # runs in the executor, returns the downloaded size
+    def _download(self, result, file, path):
+        base = result.get("pdfDownloadDomain") or self.session.url
+        params = {}
+        if "compileGroup" in result:
+            params["compileGroup"] = result["compileGroup"]
+        if "clsiServerId" in result:
+            params["clsiserverid"] = result["clsiServerId"]
+        with self.session.httpHandler.get(base + file["url"], params=params, stream=True) as response:
+            response.raise_for_status()
+            _, size = streamToFile(response, path)
+        return size
+
+    async def _fetch(self, result, file, path):
+        with self.stats.timer("download"):
+            size = await get_event_loop().run_in_executor(None, self._download, result, file, path)
+        self.stats.add("downloaded size", size / 1024, "kB")
+
+
+    # --- #
+    # api # (to be used by AirLatexSession)
+    # --- #
+
+    async def compile(self, project):
+        """
+        Compiles the project & downloads the changed outputs.
+        Returns the compile status, the paths of the outputs & a summary of the timings.
+        """
+        loop = get_event_loop()
+        directory = os.path.join(self.directory, project["id"])
+        os.makedirs(directory, exist_ok=True)
+
+        start = perf_counter()
+        with self.stats.timer("compile"):
+            result = await loop.run_in_executor(None, self._compile, project)
+        compiled = perf_counter()
+        status = result.get("status", "unknown")
+        self.log.debug("Compile of %s: %s", project["id"], status)
+
+        # outputs that changed since the last download
+        builds = self._readBuilds(project["id"])
+        paths = {}
+        downloads = []
+        for file in result.get("outputFiles", []):
+            if file["path"] not in self.outputs:
+                continue
+            path = paths[file["path"]] = os.path.join(directory, file["path"])
+            build = file.get("hash") or file.get("build")
+            if build is not None and builds.get(file["path"]) == build and os.path.exists(path):
+                self.stats.add("outputs unchanged", 1)
+                continue
+            downloads.append((file, build))
+
+        results = await gather(*[self._fetch(result, file, paths[file["path"]]) for file, _ in downloads], return_exceptions=True)
+        fetched = 0
+        for (file, build), e in zip(downloads, results):
+            if isinstance(e, Exception):
+                self.log.info("Could not download %s: %s", file["path"], e)
+                del paths[file["path"]]
+            else:
+                builds[file["path"]] = build
+                fetched += 1
+        await loop.run_in_executor(None, self._writeBuilds, project["id"], builds)
+        downloaded = perf_counter()
+
+        summary = "compiled in %.2fs, downloaded %i of %i output(s) in %.2fs" % (compiled - start, fetched, len(paths), downloaded - compiled)
+        return status, paths, summary
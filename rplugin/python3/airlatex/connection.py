@@ -0,0 +1,190 @@
+from asyncio import sleep, create_task
+from time import time, monotonic
+from logging import getLogger
+from airlatex.util import _genTimeStamp, Stats
+from airlatex.protocol import parseHandshake
+from airlatex.project_handler import AirLatexProject
+
+
+class ConnectionManager:
+
+    def __init__(self, session, heartbeat=20, handshake_reuse=60, reconnect_max_delay=60, tick=1, compression=None, prefetch={}, snapshots=None):
+        """
+        Runs the websocket connections of all open projects on the plugin's event loop:
+        - a single heartbeat task serves every connection (checking them every tick seconds)
+        - heartbeats are scheduled from the timeouts of the socket.io handshake (heartbeat is used
+          if the server has none) and only sent if no other message has been sent meanwhile
+        - a connection is considered dead if the server's heartbeats stop (see _silenceTimeout)
+        - socket.io handshakes use the session's non-blocking http client (and skip the project page
+          if it has been loaded within the last handshake_reuse seconds)
+        - dropped connections are reestablished with exponential backoff (1s, 2s, 4s, ... up to
+          reconnect_max_delay seconds, 0 disables reconnecting)
+        - websockets offer permessage-deflate if compression options are given (see tornado's
+          compression_options, e.g. {"compression_level": 6, "mem_level": 8})
+        - documents are prefetched according to prefetch (arguments of Prefetcher)
+        - documents are kept on disk in snapshots (a SnapshotCache, or None)
+        - handshake & connection costs and the traffic are recorded in stats (see :AirLatexStats)
+        """
+        self.session = session
+        self.heartbeat = heartbeat
+        self.handshake_reuse = handshake_reuse
+        self.reconnect_max_delay = reconnect_max_delay
+        self.tick = tick
+        self.compression = compression
+        self.prefetch = prefetch
+        self.snapshots = snapshots
+        self.traffic = {"wire in": 0, "payload in": 0, "wire out": 0, "payload out": 0}
+        self.projects = {}
+        self.heartbeat_task = None
+        self.project_page_time = 0
+        self.stats = Stats()
+        self.log = getLogger("AirLatex")
+
+
+    # ------- #
+    # helpers #
+    # ------- #
+
+    async def _handshake(self):
+        """
+        Query websites websocket meta information to be used for a new connection.
+        """
+        http = self.session.http
+
+        with self.stats.timer("handshake"):
+
+            # refresh session cookies (unless the project page has been loaded recently)
+            if time() - self.project_page_time > self.handshake_reuse:
+                await http.get(self.session.url + "/project")
+                self.project_page_time = time()
+
+            # To establish a websocket connection
+            # the client must query for a sec url
+            channelInfo = await http.get(self.session.url + "/socket.io/1/?t="+_genTimeStamp())
+            self.log.debug("Websocket channelInfo '%s'", channelInfo.text)
+            wsChannel, heartbeat_timeout, transports = parseHandshake(channelInfo.text)
+            self.log.debug("Websocket wsChannel '%s' (heartbeat timeout %s, transports %s)", wsChannel, heartbeat_timeout, transports)
+        url = ("wss://" if self.session.https else "ws://") + self.session.domain + "/socket.io/1/websocket/"+wsChannel
+        return url, heartbeat_timeout
+
+    # send heartbeats well before the server's heartbeat timeout runs out
+    def _heartbeatInterval(self, handler):
+        if handler.heartbeat_timeout:
+            return handler.heartbeat_timeout * 0.4
+        return self.heartbeat
+
+    # once the interval of the server's heartbeats is known, a connection is considered dead
+    # after missing more than one of them (but not later than the heartbeat timeout)
+    def _silenceTimeout(self, handler):
+        if handler.server_heartbeat is None:
+            return None
+        timeout = 1.5*handler.server_heartbeat + 2*self.tick
+        return min(timeout, handler.heartbeat_timeout) if handler.heartbeat_timeout else timeout
+
+    async def _heartbeatLoop(self):
+        while self.projects:
+            await sleep(self.tick)
+            now = monotonic()
+            for handler in list(self.projects.values()):
+                if handler.ws is None or not handler.project.get("connected"):
+                    continue
+
+                # server went silent
+                silence = now - handler.last_received
+                timeout = self._silenceTimeout(handler)
+                if timeout is not None and silence > timeout:
+                    self.stats.add("dead connections", 1)
+                    create_task(handler.disconnect("Error: The server did not send anything for %i seconds." % silence, reconnect=True))
+
+                # heartbeat (skipped if other messages have been sent)
+                elif now - handler.last_sent > self._heartbeatInterval(handler):
+                    await handler.keep_alive()
+
+    async def _run(self, handler):
+        delay = 1
+        try:
+            while True:
+                with self.stats.timer("connection lifetime"):
+                    await handler.start()
+
+                # closed on purpose
+                if not handler.reconnect:
+                    break
+                if not self.reconnect_max_delay:
+                    await handler.disconnect("Connection lost.")
+                    break
+                handler.connectionLost()
+
+                # connection has been usable => start with short delay again
+                if handler.accepted:
+                    delay = 1
+
+                # wait & reconnect
+                while handler.reconnect:
+                    await handler.sidebarMsg("Connection lost. Reconnecting in %is." % delay)
+                    await sleep(delay)
+                    delay = min(2*delay, self.reconnect_max_delay)
+                    try:
+                        handler.url, handler.heartbeat_timeout = await self._handshake()
+                        break
+                    except Exception as e:
+                        self.log.debug("Reconnect failed: %s", e)
+                if not handler.reconnect:
+                    break
+                self.stats.add("reconnects", 1)
+        finally:
+            if handler.ws is not None:
+                handler.connectionLost()
+            if self.projects.get(handler.project["id"]) is handler:
+                del self.projects[handler.project["id"]]
+            for key, value in handler.trafficStats().items():
+                self.traffic[key] += value
+
+
+    # --- #
+    # api # (to be used by AirLatexSession)
+    # --- #
+
+    async def open(self, project, user_id, sidebar, cookie=None, wait_for=15):
+        """
+        Connects to a project and registers the connection for the shared heartbeat.
+        """
+        url, heartbeat_timeout = await self._handshake()
+        handler = AirLatexProject(url, project, user_id, sidebar, cookie=cookie, wait_for=wait_for, compression=self.compression, prefetch=self.prefetch, snapshots=self.snapshots)
+        handler.heartbeat_timeout = heartbeat_timeout
+        self.projects[project["id"]] = handler
+        self.stats.add("open connections", len(self.projects))
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = create_task(self._heartbeatLoop())
+        create_task(self._run(handler))
+        return handler
+
+    async def closeAll(self, msg="Disconnected."):
+        for handler in list(self.projects.values()):
+            await handler.disconnect(msg)
+        self.projects.clear()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+
+    def format(self, indent=""):
+        lines = ["%sconnections: %i, heartbeat tasks: %i" % (indent, len(self.projects), int(self.heartbeat_task is not None and not self.heartbeat_task.done()))]
+
+        # bytes on the wire vs. uncompressed payload
+        traffic = dict(self.traffic)
+        for handler in self.projects.values():
+            for key, value in handler.trafficStats().items():
+                traffic[key] += value
+        for direction in ["in", "out"]:
+            wire, payload = traffic["wire "+direction], traffic["payload "+direction]
+            lines.append("%s%s: %i bytes on the wire, %i bytes payload (%.0f%%)" % (indent, "received" if direction == "in" else "sent", wire, payload, 100 * wire / payload if payload else 100))
+        lines += self.stats.format(indent)
+
+        # prefetched documents
+        for handler in self.projects.values():
+            if handler.prefetcher.stats.entries:
+                lines += ["%sprefetch (%s):" % (indent, handler.project.get("name", handler.project["id"]))] + handler.prefetcher.stats.format(indent+"  ")
+            if handler.mirror is not None:
+                lines += ["%smirror (%s):" % (indent, handler.mirror.directory)] + handler.mirror.stats.format(indent+"  ")
+            if handler.search is not None and handler.search.stats.entries:
+                lines += ["%sgrep (%s):" % (indent, handler.project.get("name", handler.project["id"]))] + handler.search.stats.format(indent+"  ")
+        return lines
@@ -1,9 +1,24 @@
 import pynvim
 from difflib import SequenceMatcher
 from threading import RLock
-from hashlib import sha1
 from asyncio import create_task
+from time import time, perf_counter
 from logging import getLogger
+from airlatex.shadowdocument import ShadowDocument
+from airlatex.ot import OTClient, transformX
+from airlatex.util import Stats
+
+# replace lines only if no other change happened in between
+SET_LINES = """
+local buffer, changedtick, edits = ...
+if changedtick and vim.api.nvim_buf_get_changedtick(buffer) ~= changedtick then
+    return nil
+end
+for _, edit in ipairs(edits) do
+    vim.api.nvim_buf_set_lines(buffer, edit[1], edit[2], false, edit[3])
+end
+return vim.api.nvim_buf_get_changedtick(buffer)
+"""
 
 if "allBuffers" not in globals():
     allBuffers = {}
@@ -16,9 +31,44 @@ class DocumentBuffer:
         self.nvim = nvim
         self.project_handler = path[0]["handler"]
         self.document = path[-1]
+        self.opened = perf_counter()
         self.initDocumentBuffer()
         self.buffer_mutex = RLock()
         self.saved_buffer = None
+        self.hash_sent = 0
+        self.stats = Stats()
+        self.load_chunk_size = self.nvim.eval("g:AirLatexLoadChunkSize")
+
+        # change tracking via nvim_buf_attach
+        self.track_changes = bool(self.nvim.eval("g:AirLatexTrackChanges"))
+        self.attached = False
+        self.changedtick = None
+        self.ignore_changedtick = None
+        self.skip_event = False
+        self.client = OTClient(self._sendOps)
+        self.remote_ops = []
+        self.remote_scheduled = False
+
+        # client ids of the connections the inflight op has been sent on
+        # (a resent op is dropped by the server if it has been applied under one of them)
+        self.sent_under = []
+
+        # snapshots on disk (stored a few seconds after the document is in sync with the server)
+        self.snapshots = self.project_handler.snapshots
+        self.snapshot_delay = 5
+        self.snapshot_handle = None
+        self.readonly = False
+
+        # flush policy for local changes & cursor updates (in seconds)
+        self.flush_debounce = self.nvim.eval("g:AirLatexFlushDebounce") / 1000
+        self.flush_max_latency = self.nvim.eval("g:AirLatexFlushMaxLatency") / 1000
+        self.cursor_interval = self.nvim.eval("g:AirLatexCursorInterval") / 1000
+        self.flush_handle = None
+        self.flush_first = None
+        self.cursor = None
+        self.cursor_sent = None
+        self.cursor_sent_time = 0
+        self.cursor_handle = None
 
     def getName(self):
         return "/".join([p["name"] for p in self.path])
@@ -28,8 +78,9 @@ class DocumentBuffer:
     def initDocumentBuffer(self):
         self.log.debug_gui("initDocumentBuffer")
 
-        # Creating new Buffer
-        self.nvim.command('wincmd w')
+        # Creating new Buffer (next to the sidebar)
+        if self.nvim.current.buffer.options["filetype"] == "airlatex":
+            self.nvim.command('wincmd w')
         self.nvim.command('enew')
         self.nvim.command('file '+self.getName())
         self.buffer = self.nvim.current.buffer
@@ -48,65 +99,232 @@ class DocumentBuffer:
         # self.nvim.command("set updatetime=500")
         # self.nvim.command("autocmd CursorMoved,CursorMovedI * :call AirLatex_update_pos()")
         # self.nvim.command("autocmd CursorHold,CursorHoldI * :call AirLatex_update_pos()")
-        self.nvim.command("au CursorMoved <buffer> call AirLatex_WriteBuffer()")
-        self.nvim.command("au CursorMovedI <buffer> call AirLatex_WriteBuffer()")
+        self.nvim.command("au CursorMoved,CursorMovedI <buffer> call AirLatex_CursorMoved(line('.'), col('.'))")
+        self.nvim.command("au InsertLeave,TextChanged <buffer> call AirLatex_WriteBuffer()")
         self.nvim.command("command! -buffer -nargs=0 W call AirLatex_WriteBuffer()")
 
-    def write(self, lines):
-        self.log.debug("writing to buffer")
-
-        def writeLines(buffer,lines):
-            buffer[0] = lines[0]
-            for l in lines[1:]:
-                buffer.append(l)
-            self.saved_buffer = buffer[:]
+    # readonly: lines are not confirmed by the server yet (e.g. snapshot of a previous session)
+    def write(self, lines, readonly=False):
+        self.log.debug("writing to buffer (%i lines)", len(lines))
+        lines = lines or [""]
+        self.readonly = readonly
+        size = self.load_chunk_size
+
+        # reload (e.g. missed updates are no longer available after a reconnect):
+        # local changes not accepted by the server are lost
+        if self.saved_buffer is not None:
+            self.log.info("Reloading document %s (local changes: %s).", self.getName(), self.client.state)
+            self.saved_buffer = None
+            self.client = OTClient(self._sendOps)
+            self.remote_ops = []
+            self.sent_under = []
+
+        # large documents are written in chunks, such that the editor stays responsive in between
+        # (buffer is not modifiable until everything has been loaded)
+        def writeLines(buffer,lines,start=0):
+            buffer.options["modifiable"] = True
+            buffer[start:] = lines[start:start+size]
+            if start+size < len(lines):
+                buffer.options["modifiable"] = False
+                self.nvim.async_call(writeLines,buffer,lines,start+size)
+                return
+            self.saved_buffer = ShadowDocument(lines)
+
+            # from now on, track changes line-wise
+            if self.track_changes:
+                self.changedtick = self.ignore_changedtick = buffer.api.get_changedtick()
+                self.attached = buffer.api.attach(False, {})
+                self.log.debug("write: attached to buffer (%s)", self.attached)
+
+            # document is editable now
+            opened = (perf_counter() - self.opened) * 1000
+            self.stats.add("open", opened, "ms")
+            self.log.info("Opened document %s (%i lines) in %.2fms.", self.getName(), len(lines), opened)
+
+            # updates that arrived while loading
+            if self.remote_ops and not self.remote_scheduled:
+                self.remote_scheduled = True
+                self._flushRemoteOps()
+
+            if self.readonly:
+                buffer.options["modifiable"] = False
+            else:
+                self.scheduleSnapshot()
+            self.mirrorChanged()
         self.nvim.async_call(writeLines,self.buffer,lines)
 
+    def setReadonly(self, readonly):
+        self.readonly = readonly
+        def setModifiable(buffer):
+            buffer.options["modifiable"] = not readonly
+        self.nvim.async_call(setModifiable, self.buffer)
+
     def updateRemoteCursor(self, cursor):
         self.log.debug("updateRemoteCursor")
         # def updateRemoteCursor(cursor, nvim):
         #     nvim.command("match ErrorMsg #\%"+str(cursor["row"])+"\%"+str(cursor["column"])+"v#")
         # self.nvim.async_call(updateRemoteCursor, cursor, self.nvim)
 
+    # ----------- #
+    # Flush Queue #
+    # ----------- #
+
+    def cursorMoved(self, row, column):
+
+        # changes are only known by comparing the whole buffer
+        if not self.attached:
+            self.scheduleFlush()
+
+        # deduplicate & rate-limit cursor updates
+        self.cursor = (row, column)
+        if self.cursor == self.cursor_sent or self.cursor_handle is not None:
+            return
+        delay = max(0, self.cursor_sent_time + self.cursor_interval - self.nvim.loop.time())
+        self.cursor_handle = self.nvim.loop.call_later(delay, self._sendCursor)
+
+    def _sendCursor(self):
+        self.cursor_handle = None
+        if self.cursor == self.cursor_sent:
+            return
+        self.cursor_sent = self.cursor
+        self.cursor_sent_time = self.nvim.loop.time()
+        create_task(self.project_handler.updateCursor(self.document, self.cursor))
+
+    # send changes after no change occured for flush_debounce seconds,
+    # but at the latest flush_max_latency seconds after the first change
+    def scheduleFlush(self):
+        now = self.nvim.loop.time()
+        if self.flush_first is None:
+            self.flush_first = now
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        delay = max(0, min(self.flush_debounce, self.flush_first + self.flush_max_latency - now))
+        self.flush_handle = self.nvim.loop.call_later(delay, self.nvim.async_call, self.writeBuffer)
+
     def writeBuffer(self):
         self.log.debug("writeBuffer: calculating changes to send")
 
-        # update CursorPosition
-        create_task(self.project_handler.updateCursor(self.document, self.nvim.current.window.cursor))
+        # flushing now
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self.flush_handle = None
+        self.flush_first = None
 
         # skip if not yet initialized
         if self.saved_buffer is None:
             self.log.debug("writeBuffer: -> buffer not yet initialized")
             return
 
+        # changes are already known from buffer events
+        if not self.attached:
+            self._localChanges(self._diffBuffer())
+            self.mirrorChanged()
+
+        # send now or as soon as the server accepted the previous changes
+        self.log.debug("writeBuffer: -> %s", self.client.state)
+        self.client.flush()
+
+    # local changes are collected by the ot client
+    def _localChanges(self, ops):
+        if len(ops) == 0:
+            return
+
+        # remote changes not yet written need to be applied after the local changes
+        if self.remote_ops:
+            ops, self.remote_ops = transformX(ops, self.remote_ops)
+        self.client.submit(ops)
+
+    # called by ot client
+    # (version & hash belong to the state the ops were flushed in: remote updates handled before
+    # they are sent bump the version & transform the client's copy, but not the ops sent)
+    def _sendOps(self, ops):
+        version = self.document["version"]
+        dup_sources = list(self.sent_under)
+        public_id = self.project_handler.public_id
+        if public_id is not None and public_id not in self.sent_under:
+            self.sent_under.append(public_id)
+
+        # overleaf/web: sends document hash (if it hasn't been sent in the last 5 seconds)
+        # (only valid if the saved buffer contains all remote changes)
+        content_hash = None
+        if not self.remote_ops and time() - self.hash_sent > 5:
+            with self.stats.timer("hash"):
+                content_hash = self.saved_buffer.contentHash()
+            self.hash_sent = time()
+
+        # send command
+        self.log.debug(" -> sending ops")
+        create_task(self.project_handler.sendOps(self.document, version, content_hash, ops, dup_sources))
+
+    # server accepted the inflight changes
+    def onAck(self):
+        self.sent_under = []
+        self.client.ack()
+        self.scheduleSnapshot()
+
+    # rejoined after a reconnect: apply the updates missed while disconnected
+    # (version is the version after the updates)
+    def catchUp(self, updates, version):
+        self.log.debug("catching up on %i updates (%s)", len(updates), self.client.state)
+        if self.readonly:
+            self.setReadonly(False)
+        acked = False
+        for update in updates:
+
+            # inflight changes have been accepted before the connection dropped
+            if not acked and self.client.inflight is not None and update.get("meta", {}).get("source") in self.sent_under:
+                self.document["version"] = update["v"]+1
+                self.sent_under = []
+                self.client.ack(flush=False)
+                acked = True
+            else:
+                self.applyUpdate(update)
+
+        # pending changes are sent once they are transformed against all missed updates
+        self.document["version"] = version
+        if acked:
+            if self.client.flush_requested:
+                self.client.flush()
+            self.scheduleSnapshot()
+
+        # inflight changes got lost: send them again
+        else:
+            self.client.resend()
+
+    # compare whole buffer with saved buffer
+    # (used if buffer is not attached)
+    def _diffBuffer(self):
+        buffer = self.buffer[:]
+        saved_buffer = self.saved_buffer[:]
+
         # nothing to do
-        if len(self.saved_buffer) == len(self.buffer):
+        if len(saved_buffer) == len(buffer):
             skip = True
-            for ol,nl in zip(self.saved_buffer, self.buffer):
+            for ol,nl in zip(saved_buffer, buffer):
                 if hash(ol) != hash(nl):
                     skip = False
                     break
             if skip:
-                self.log.debug("writeBuffer: -> done (hashtest says nothing to do)")
-                return
+                self.log.debug("_diffBuffer: -> done (hashtest says nothing to do)")
+                return []
 
         # cummulative position of line
         pos = [0]
-        for row in self.saved_buffer:
+        for row in saved_buffer:
             # pos.append(pos[-1]+ ( len(row)+1 if len(row) > 0 else 0 ) )
             pos.append(pos[-1]+len(row)+1)
 
         # first calculate diff row-wise
         ops = []
-        S = SequenceMatcher(None, self.saved_buffer, self.buffer, autojunk=False).get_opcodes()
+        S = SequenceMatcher(None, saved_buffer, buffer, autojunk=False).get_opcodes()
         for op in S:
             if op[0] == "equal":
                 continue
 
             # inserting a whole row
             elif op[0] == "insert":
-                s = "\n".join(self.buffer[op[3]:op[4]])
-                if op[1] >= len(self.saved_buffer):
+                s = "\n".join(buffer[op[3]:op[4]])
+                if op[1] >= len(saved_buffer):
                     p = pos[-1] - 1
                     s = "\n" + s
                 else:
@@ -116,8 +334,8 @@ class DocumentBuffer:
 
             # deleting a whole row
             elif op[0] == "delete":
-                s = "\n".join(self.saved_buffer[op[1]:op[2]])
-                if op[1] == len(self.buffer):
+                s = "\n".join(saved_buffer[op[1]:op[2]])
+                if op[1] == len(buffer):
                     p = pos[-(op[2]-op[1])-1] - 1
                     s = "\n" + s
                 else:
@@ -127,8 +345,8 @@ class DocumentBuffer:
 
             # for replace, check in more detail what has changed
             elif op[0] == "replace":
-                old = "\n".join(self.saved_buffer[op[1]:op[2]])
-                new = "\n".join(self.buffer[op[3]:op[4]])
+                old = "\n".join(saved_buffer[op[1]:op[2]])
+                new = "\n".join(buffer[op[3]:op[4]])
                 S2 = SequenceMatcher(None, old, new, autojunk=False).get_opcodes()
                 for op2 in S2:
                     # relative to document end
@@ -147,32 +365,73 @@ class DocumentBuffer:
                     elif op2[0] == "delete":
                         ops.append({"p": linestart + op2[1], "d": old[op2[1]:op2[2]]})
 
-        # nothing to do
-        if len(ops) == 0:
-            self.log.debug("writeBuffer: -> done (sequencematcher says nothing to do)")
-            return
-
         # reverse, as last op should be applied first
         ops.reverse()
 
-        # compute sha1-hash of current buffer
-        buffer_cpy = self.buffer[:]
-        current_len = 0
-        for row in buffer_cpy:
-            current_len += len(row)+1
-        current_len -= 1
-        tohash = ("blob "+str(current_len) + "\x00")
-        for b in buffer_cpy[:-1]:
-            tohash += b+"\n"
-        tohash += buffer_cpy[-1]
-        sha = sha1()
-        sha.update(tohash.encode())
-        content_hash = sha.hexdigest()
-
-        # update saved buffer & send command
-        self.saved_buffer = self.buffer[:]
-        self.log.debug(" -> sending ops")
-        create_task(self.project_handler.sendOps(self.document, content_hash, ops))
+        # update saved buffer
+        self.saved_buffer = ShadowDocument(buffer)
+        return ops
+
+    # -------------------- #
+    # buffer change events # (see :help nvim_buf_attach)
+    # -------------------- #
+
+    def onLines(self, changedtick, firstline, lastline, linedata):
+
+        # multipart changes do not repeat the changedtick
+        if changedtick is not None:
+            self.changedtick = changedtick
+            self.skip_event = self.ignore_changedtick is not None and changedtick <= self.ignore_changedtick
+
+        # skip if not yet initialized or change has been written by ourselfs
+        if self.saved_buffer is None or self.skip_event:
+            return
+
+        self._localChanges(self._diffLines(firstline, lastline, linedata))
+        self.saved_buffer[firstline:lastline] = linedata
+        self.scheduleFlush()
+        self.mirrorChanged()
+
+    def onChangedtick(self, changedtick):
+        self.changedtick = changedtick
+
+    def onDetach(self):
+        self.log.debug("onDetach: falling back to whole buffer comparison")
+        self.attached = False
+
+    # convert replacement of lines [firstline, lastline) by linedata into ops
+    def _diffLines(self, firstline, lastline, linedata):
+        old = self.saved_buffer[firstline:lastline]
+
+        # newlines are attached such that the changed region never exceeds the document
+        if lastline < len(self.saved_buffer):
+            p = self.saved_buffer.offset(firstline)
+            old = "".join(l+"\n" for l in old)
+            new = "".join(l+"\n" for l in linedata)
+        elif firstline > 0:
+            p = self.saved_buffer.offset(firstline) - 1
+            old = "".join("\n"+l for l in old)
+            new = "".join("\n"+l for l in linedata)
+        else:
+            p = 0
+            old = "\n".join(old)
+            new = "\n".join(linedata)
+
+        # strip common prefix & suffix
+        prefix = 0
+        maxlen = min(len(old), len(new))
+        while prefix < maxlen and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < maxlen - prefix and old[-1-suffix] == new[-1-suffix]:
+            suffix += 1
+
+        ops = []
+        if len(old) - suffix > prefix:
+            ops.append({"p": p + prefix, "d": old[prefix:len(old)-suffix]})
+        if len(new) - suffix > prefix:
+            ops.append({"p": p + prefix, "i": new[prefix:len(new)-suffix]})
+        return ops
 
     def applyUpdate(self,ops):
         self.log.debug("apply server updates to buffer")
@@ -186,86 +445,148 @@ class DocumentBuffer:
         # do nothing if no op included
         if not 'op' in ops:
             return
-        self.log.debug("got ops:"+str(ops))
-        ops = ops['op']
-
-        # async execution
-        def applyOps(self, ops):
-            self.buffer_mutex.acquire()
-            try:
-                for op in ops:
-
-                    # delete char and lines
-                    if 'd' in op:
-                        p = op['p']
-                        s = op['d']
-                        self._remove(self.saved_buffer,p,s)
-                        self._remove(self.buffer,p,s)
-
-                    # add characters and newlines
-                    if 'i' in op:
-                        p = op['p']
-                        s = op['i']
-                        self._insert(self.saved_buffer,p,s)
-                        self._insert(self.buffer,p,s)
-            finally:
-                self.buffer_mutex.release()
-        self.nvim.async_call(applyOps, self, ops)
-
-    # inster string at given position
-    def _insert(self, buffer, start, string):
-        p_linestart = 0
-
-        # find start line
-        for line_i, line in enumerate(self.buffer):
-
-            # start is not yet there
-            if start >= p_linestart+len(line)+1:
-                p_linestart += len(line)+1
+        self.log.debug("got ops:%s", ops)
+        self.remote_ops += self.client.receive(ops['op'])
+
+        # collect all updates that arrive until the buffer is written
+        if not self.remote_scheduled:
+            self.remote_scheduled = True
+            self.nvim.async_call(self._flushRemoteOps)
+
+    # apply collected remote ops to saved buffer, then write it to the buffer at once
+    def _flushRemoteOps(self):
+        self.remote_scheduled = False
+
+        # buffer is still loading
+        if self.saved_buffer is None:
+            return
+
+        # local changes need to be known, such that saved buffer equals the buffer
+        if not self.attached:
+            self._localChanges(self._diffBuffer())
+        ops, self.remote_ops = self.remote_ops, []
+
+        self.buffer_mutex.acquire()
+        try:
+            regions = []
+            undo = []
+            for op in ops:
+
+                # delete char and lines
+                if 'd' in op:
+                    undo.append(self._applyToSaved(regions, op['p'], op['d'], insert=False))
+
+                # add characters and newlines
+                if 'i' in op:
+                    undo.append(self._applyToSaved(regions, op['p'], op['i'], insert=True))
+
+            # write all changed regions (bottom-up) in a single call
+            edits = []
+            shift = 0
+            for start, end, num in regions:
+                edits.append([start-shift, start-shift+num, self.saved_buffer[start:end]])
+                shift += end - start - num
+            edits.reverse()
+            changedtick = self.nvim.exec_lua(SET_LINES, self.buffer, self.changedtick if self.attached else False, edits)
+
+            # buffer events not yet processed: undo & retry once the saved buffer is up to date
+            if changedtick is None:
+                for line_i, lines, num in reversed(undo):
+                    self.saved_buffer[line_i:line_i+num] = lines
+                self.remote_ops[:0] = ops
+                self.remote_scheduled = True
+                self.nvim.loop.call_later(0.05, self.nvim.async_call, self._flushRemoteOps)
+                return
+
+            # the resulting buffer events are no local changes
+            if self.attached:
+                self.changedtick = self.ignore_changedtick = changedtick
+        finally:
+            self.buffer_mutex.release()
+        self.scheduleSnapshot()
+        self.mirrorChanged()
+
+    # local mirror of the project writes the document from the saved buffer
+    def mirrorChanged(self):
+        if self.project_handler.mirror is not None:
+            self.project_handler.mirror.docChanged(self.document["_id"])
+
+    # store the document on disk, once it is in sync with the server
+    # (no op inflight & no pending local changes, which the server's version does not include;
+    # retried by the next ack or remote update otherwise)
+    def scheduleSnapshot(self):
+        if self.snapshots is None or self.snapshot_handle is not None:
+            return
+        self.snapshot_handle = self.nvim.loop.call_later(self.snapshot_delay, self.nvim.async_call, self._storeSnapshot)
+
+    def _storeSnapshot(self):
+        self.snapshot_handle = None
+        if self.saved_buffer is None or self.readonly or self.remote_ops or self.client.state != "synchronized" or self.client.pending:
+            return
+        create_task(self.snapshots.store(self.project_handler.project["id"], self.document["_id"], self.saved_buffer[:], self.document["version"]))
+
+    # apply a single insert/remove to the saved buffer
+    # - regions collects the changed lines as [start, end, number of lines in buffer]
+    # - returns the information needed to undo the change
+    def _applyToSaved(self, regions, p, string, insert):
+        line_i, col = self.saved_buffer.find(p)
+        if insert:
+            num, new_num = 1, string.count("\n")+1
+            lines = self.saved_buffer[line_i:line_i+num]
+            self._insert(self.saved_buffer, line_i, col, string)
+        else:
+            num, new_num = string.count("\n")+1, 1
+            lines = self.saved_buffer[line_i:line_i+num]
+            self._remove(self.saved_buffer, line_i, col, string)
+
+        # merge with overlapping & adjacent regions, shift the following ones
+        first, last, delta = line_i, line_i+num, new_num-num
+        before, after = [], []
+        start, end, covered, buffer_num = first, last, 0, 0
+        for r in regions:
+            if r[1] < first:
+                before.append(r)
+            elif r[0] > last:
+                after.append([r[0]+delta, r[1]+delta, r[2]])
             else:
-                break
+                start, end = min(start, r[0]), max(end, r[1])
+                covered += r[1] - r[0]
+                buffer_num += r[2]
+        regions[:] = before + [[start, end+delta, end-start-covered+buffer_num]] + after
+
+        return line_i, lines, new_num
+
+    # inster string at given line & column
+    def _insert(self, buffer, line_i, col, string):
+        line = buffer[line_i]
 
         # convert format to array-style
         string = string.split("\n")
 
         # append end of current line to last line of new line
-        string[-1] += line[(start-p_linestart):]
+        string[-1] += line[col:]
 
         # include string at start position
-        buffer[line_i] = line[:(start-p_linestart)] + string[0]
+        buffer[line_i] = line[:col] + string[0]
 
         # append rest to next line
         if len(string) > 1:
             buffer[line_i+1:line_i+1] = string[1:]
 
-    # remove len chars from pos
-    def _remove(self, buffer, start, string):
-        p_linestart = 0
-
-        # find start line
-        for line_i, line in enumerate(buffer):
-
-            # start is not yet there
-            if start >= p_linestart+len(line)+1:
-                p_linestart += len(line)+1
-            else:
-                break
+    # remove string from given line & column
+    def _remove(self, buffer, line_i, col, string):
 
         # convert format to array-style
         string = string.split("\n")
-        new_string = ""
 
         # remove first line from found position
-        new_string = line[:(start-p_linestart)]
+        new_string = buffer[line_i][:col]
 
         # add rest of last line to new string
         if len(string) == 1:
-            new_string += buffer[line_i+len(string)-1][(start-p_linestart)+len(string[-1]):]
+            new_string += buffer[line_i][col+len(string[-1]):]
         else:
             new_string += buffer[line_i+len(string)-1][len(string[-1]):]
 
         # overwrite buffer
         buffer[line_i:line_i+len(string)] = [new_string]
-
-
-
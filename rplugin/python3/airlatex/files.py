@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+from threading import Lock
+from asyncio import Semaphore, gather, get_event_loop
+from logging import getLogger
+from airlatex.util import Stats
+
+
+# write a (streamed) response to path in chunks, returns sha1 & size of the content
+def streamToFile(response, path, chunk_size=64*1024):
+    sha1 = hashlib.sha1()
+    size = 0
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                sha1.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return sha1.hexdigest(), size
+
+
+class FileCache:
+
+    def __init__(self, session, directory, concurrency=4, chunk_size=64):
+        """
+        Downloads binary project files (fileRefs) through the authenticated http session:
+        - responses are streamed to disk in chunks of chunk_size kilobytes (never kept in memory)
+        - files are stored content-addressed (directory/blobs/<sha1>.<ext>), such that identical
+          files of several projects are kept only once
+        - the blob, ETag & Last-Modified of every fileRef are kept in directory/refs/<project_id>.json,
+          known files are revalidated with conditional requests (304 => no download)
+        - at most concurrency downloads run at the same time
+        """
+        self.session = session
+        self.directory = os.path.expanduser(directory)
+        self.semaphore = Semaphore(concurrency)
+        self.chunk_size = chunk_size * 1024
+        self.index_lock = Lock()
+        self.stats = Stats()
+        self.log = getLogger("AirLatex")
+
+
+    # ------- #
+    # helpers #
+    # ------- #
+
+    def _indexPath(self, project_id):
+        return os.path.join(self.directory, "refs", project_id + ".json")
+
+    def _readIndex(self, project_id):
+        try:
+            with open(self._indexPath(project_id), encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _updateIndex(self, project_id, file_id, entry):
+        with self.index_lock:
+            index = self._readIndex(project_id)
+            index[file_id] = entry
+            path = self._indexPath(project_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf8") as f:
+                json.dump(index, f)
+            os.replace(path + ".tmp", path)
+
+    # runs in the executor, returns the local path & the downloaded size (None if not modified)
+    def _download(self, project_id, file):
+        entry = self._readIndex(project_id).get(file["_id"])
+        if entry is not None and not os.path.exists(entry["path"]):
+            entry = None
+
+        # revalidate known files
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        url = self.session.url + "/project/%s/file/%s" % (project_id, file["_id"])
+        with self.session.httpHandler.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and entry is not None:
+                return entry["path"], None
+            response.raise_for_status()
+
+            # stream into a temporary file (hashed on the way), then move it to its blob
+            blobs = os.path.join(self.directory, "blobs")
+            os.makedirs(blobs, exist_ok=True)
+            tmp = os.path.join(blobs, "%s.%s" % (project_id, file["_id"]))
+            digest, size = streamToFile(response, tmp, self.chunk_size)
+            _, ext = os.path.splitext(file["name"])
+            path = os.path.join(blobs, digest + ext)
+            os.replace(tmp, path)
+
+            self._updateIndex(project_id, file["_id"], {
+                "name": file["name"],
+                "path": path,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            })
+        return path, size
+
+
+    # --- #
+    # api # (to be used by AirLatexSession & Sidebar)
+    # --- #
+
+    def cached(self, project_id, file_id):
+        """
+        Local path of a file downloaded before (without revalidating it) or None.
+        """
+        entry = self._readIndex(project_id).get(file_id)
+        if entry is None or not os.path.exists(entry["path"]):
+            return None
+        return entry["path"]
+
+    async def fetch(self, project_id, file):
+        """
+        Local path of the (up to date) fileRef.
+        """
+        async with self.semaphore:
+            with self.stats.timer("download"):
+                path, size = await get_event_loop().run_in_executor(None, self._download, project_id, file)
+        if size is None:
+            self.stats.add("not modified", 1)
+        else:
+            self.stats.add("downloaded size", size / 1024, "kB")
+        return path
+
+    async def fetchAll(self, project_id, files):
+        """
+        Downloads the fileRefs in parallel, returns their local paths (or exceptions).
+        """
+        return await gather(*[self.fetch(project_id, file) for file in files], return_exceptions=True)
@@ -0,0 +1,101 @@
+from urllib.request import Request
+from urllib.parse import urljoin, urlencode
+from logging import getLogger
+from tornado.httpclient import HTTPRequest
+from airlatex.util import Stats
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient as Client
+except ImportError:
+    from tornado.simple_httpclient import SimpleAsyncHTTPClient as Client
+
+
+# response headers as expected by CookieJar.extract_cookies
+class _CookieHeaders:
+    def __init__(self, headers):
+        self.headers = headers
+
+    def info(self):
+        return self
+
+    def get_all(self, name, default=None):
+        return self.headers.get_list(name) or default
+
+
+class Response:
+    def __init__(self, response):
+        self.url = response.effective_url
+        self.status_code = response.code
+        self.ok = response.code < 400
+        self.headers = response.headers
+        self.content = response.body or b""
+
+    @property
+    def text(self):
+        return self.content.decode("utf8", "replace")
+
+
+class AsyncHTTP:
+
+    def __init__(self, cookies, max_clients=10, timeout=30, max_redirects=5):
+        """
+        Non-blocking http client of the session (runs on the plugin's event loop):
+        - uses libcurl if pycurl is installed (keeping a pool of keep-alive connections),
+          tornado's simple client otherwise
+        - shares the cookie jar cookies (the jar of requests.Session used for streamed downloads,
+          the websocket handshake sends the same cookies)
+        - follows redirects itself, such that cookies set by redirecting responses are kept
+        - at most max_clients requests run at the same time, timings are recorded in stats
+        """
+        self.cookies = cookies
+        self.max_clients = max_clients
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.client = None
+        self.stats = Stats()
+        self.log = getLogger("AirLatex")
+
+
+    # --- #
+    # api # (to be used by AirLatexSession & ConnectionManager)
+    # --- #
+
+    async def fetch(self, method, url, data=None, headers={}, follow_redirects=True):
+        """
+        Request with the cookies of the jar, data is sent form-encoded.
+        Errors are returned as (not ok) responses, failed connections raise.
+        """
+        # created on first use, such that it is bound to the running event loop
+        if self.client is None:
+            self.client = Client(force_instance=True, max_clients=self.max_clients)
+
+        for _ in range(self.max_redirects + 1):
+            request = Request(url, method=method, headers=headers)
+            self.cookies.add_cookie_header(request)
+            body = urlencode(data) if data is not None else None
+            request_headers = dict(request.header_items())
+            if body is not None:
+                request_headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+
+            with self.stats.timer(method):
+                response = await self.client.fetch(HTTPRequest(url, method=method, headers=request_headers, body=body, follow_redirects=False, request_timeout=self.timeout), raise_error=False)
+            self.cookies.extract_cookies(_CookieHeaders(response.headers), request)
+            self.log.debug("%s %s => %i", method, url, response.code)
+
+            # redirected (POST is continued as GET)
+            if not follow_redirects or response.code not in (301, 302, 303, 307, 308) or "Location" not in response.headers:
+                return Response(response)
+            url = urljoin(url, response.headers["Location"])
+            if response.code in (301, 302, 303):
+                method, data = "GET", None
+        return Response(response)
+
+    async def get(self, url, **kwargs):
+        return await self.fetch("GET", url, **kwargs)
+
+    async def post(self, url, data=None, **kwargs):
+        return await self.fetch("POST", url, data=data, **kwargs)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
@@ -0,0 +1,205 @@
+import os
+import shutil
+import hashlib
+from asyncio import gather, get_event_loop, create_task
+from logging import getLogger
+from airlatex.util import Stats
+
+
+class ProjectMirror:
+
+    def __init__(self, handler, directory, files, delay=0.05):
+        """
+        Keeps a local directory in sync with a joined project (e.g. for local latexmk builds):
+        - paths follow the project tree (see ProjectIndex), entities that are added, renamed, moved
+          or removed while mirroring are written to their new path & removed from their old one
+        - opened documents are written from their buffers, all other documents are joined
+          without a buffer (see RemoteDocuments)
+        - fileRefs are copied from the FileCache
+        - files are only rewritten if their content hash changed
+        - changes of a document are written delay seconds after the first change
+        """
+        self.handler = handler
+        self.directory = os.path.expanduser(directory)
+        self.files = files
+        self.delay = delay
+        self.hashes = {}
+        self.handles = {}
+        self.stats = Stats()
+        self.log = getLogger("AirLatex")
+        handler.remote.listeners.append(self.docChanged)
+
+
+    # ------- #
+    # helpers #
+    # ------- #
+
+    # local path of a document or file (None if it is not part of the project anymore)
+    def _localPath(self, entity_id):
+        if self.handler.index.get(entity_id) is None:
+            return None
+        return os.path.join(self.directory, *self.handler.index.path(entity_id).split("/"))
+
+    # local paths of an entity & everything inside of it (by id)
+    def _localPaths(self, entity_id):
+        entity = self.handler.index.get(entity_id)
+        if entity is None:
+            return {}
+        paths = {entity_id: self._localPath(entity_id)}
+        if entity["type"] == "folder":
+            for child in entity["docs"] + entity["fileRefs"] + entity["folders"]:
+                paths.update(self._localPaths(child["_id"]))
+        return paths
+
+    # remove a file written before (directories only if they are empty)
+    def _removePath(self, path):
+        self.hashes.pop(path, None)
+        try:
+            if os.path.isdir(path):
+                os.rmdir(path)
+            else:
+                os.remove(path)
+        except OSError:
+            return False
+        return True
+
+    def _fileHash(self, path):
+        sha1 = hashlib.sha1()
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(64*1024), b""):
+                    sha1.update(chunk)
+        except OSError:
+            return None
+        return sha1.hexdigest()
+
+    # hash of the file as last written (or as found on disk)
+    def _knownHash(self, path):
+        if path not in self.hashes:
+            self.hashes[path] = self._fileHash(path)
+        return self.hashes[path]
+
+    def _writeFile(self, path, data):
+        digest = hashlib.sha1(data).hexdigest()
+        if self._knownHash(path) == digest:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self.hashes[path] = digest
+        return True
+
+    # runs in the executor (blobs are named by their sha1)
+    def _copyFile(self, path, blob):
+        digest = os.path.splitext(os.path.basename(blob))[0]
+        if self._knownHash(path) == digest:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(blob, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.hashes[path] = digest
+        return True
+
+    def _writeDoc(self, doc_id):
+        self.handles.pop(doc_id, None)
+        path = self._localPath(doc_id)
+        if path is None:
+            return
+
+        # opened => buffer knows the latest state
+        if doc_id in self.handler.documents:
+            saved_buffer = self.handler.documents[doc_id]["buffer"].saved_buffer
+            if saved_buffer is None:
+                return
+            text = "\n".join(saved_buffer[:])
+        elif self.handler.remote.text(doc_id) is not None:
+            text = self.handler.remote.text(doc_id)
+        else:
+            return
+
+        with self.stats.timer("write"):
+            written = self._writeFile(path, (text + "\n").encode("utf8"))
+        self.stats.add("documents written" if written else "documents unchanged", 1)
+
+    async def _join(self, doc_id):
+        await self.handler.remote.join(doc_id)
+        self._writeDoc(doc_id)
+
+    async def _sync(self, coroutines, what):
+        for result in await gather(*coroutines, return_exceptions=True):
+            if isinstance(result, Exception):
+                self.log.info("Mirror: could not sync %s: %s", what, repr(result))
+
+
+    # --- #
+    # api # (to be used by AirLatexProject & DocumentBuffer)
+    # --- #
+
+    async def start(self):
+        """
+        (Re)builds the directory from the project tree.
+        """
+        self.hashes = {}
+        os.makedirs(self.directory, exist_ok=True)
+        index = self.handler.index
+
+        with self.stats.timer("sync"):
+            joins = []
+            for doc_id in [doc["_id"] for doc in index.documents()]:
+                if doc_id in self.handler.documents or self.handler.remote.text(doc_id) is not None:
+                    self._writeDoc(doc_id)
+                else:
+                    joins.append(self._join(doc_id))
+            await self._sync(joins, "documents")
+            await self._sync([self.fetchFile(file) for file in index.documents("fileRef")], "files")
+
+    async def fetchFile(self, file):
+        blob = await self.files.fetch(self.handler.project["id"], file)
+        path = self._localPath(file["_id"])
+        written = await get_event_loop().run_in_executor(None, self._copyFile, path, blob)
+        self.stats.add("files written" if written else "files unchanged", 1)
+
+    def paths(self, entity_id):
+        """
+        Local paths of an entity (& its contents), to be passed to treeChanged.
+        """
+        return self._localPaths(entity_id)
+
+    def treeChanged(self, entity_id, old_paths):
+        """
+        Entity has been added, renamed, moved or removed (old_paths as returned by paths before).
+        """
+        new_paths = self._localPaths(entity_id)
+
+        # files first, then directories (deepest first)
+        moved = [path for child_id, path in old_paths.items() if new_paths.get(child_id) != path]
+        for path in sorted(moved, key=lambda path: (os.path.isdir(path), -len(path))):
+            if self._removePath(path):
+                self.stats.add("paths removed", 1)
+
+        # write the entity to its new path
+        coroutines = []
+        for child_id, path in new_paths.items():
+            if old_paths.get(child_id) == path:
+                continue
+            entity = self.handler.index.get(child_id)
+            if entity["type"] == "file":
+                if child_id in self.handler.documents or self.handler.remote.text(child_id) is not None:
+                    self._writeDoc(child_id)
+                else:
+                    coroutines.append(self._join(child_id))
+            elif entity["type"] == "fileRef":
+                coroutines.append(self.fetchFile(entity))
+        if coroutines:
+            create_task(self._sync(coroutines, "tree change"))
+
+    def docChanged(self, doc_id):
+        if doc_id not in self.handles:
+            self.handles[doc_id] = get_event_loop().call_later(self.delay, self._writeDoc, doc_id)
+
+    def stop(self):
+        self.handler.remote.listeners.remove(self.docChanged)
+        for handle in self.handles.values():
+            handle.cancel()
+        self.handles = {}
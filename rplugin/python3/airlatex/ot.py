@@ -0,0 +1,289 @@
+from math import inf
+
+# ShareJS text operations (as used by overleaf) are lists of components
+#   {"p": position, "i": inserted string} or {"p": position, "d": deleted string}
+# that are applied one after another.
+#
+# For composing, an operation is converted to a list of pieces relative to the original document:
+#   ["r", n]  retain n characters
+#   ["i", s]  insert s
+#   ["d", s]  delete s
+# the last piece always retains the (unknown) rest of the document.
+
+
+def compose(ops):
+    """
+    Compacts a list of op components into the smallest equivalent list:
+    - merges adjacent & overlapping inserts and deletes
+    - drops inserts that are deleted again & deletes that are inserted again
+    - orders components by position (deletes before inserts)
+    """
+    pieces = [["r", inf]]
+    for op in ops:
+        if op.get("d"):
+            _delete(pieces, op["p"], op["d"])
+        if op.get("i"):
+            _insert(pieces, op["p"], op["i"])
+    return _emit(_normalize(pieces))
+
+
+# index of the piece starting at position p of the resulting document
+# (splits pieces if necessary, deletions at p are skipped)
+def _seek(pieces, p):
+    out = 0
+    k = 0
+    while True:
+        kind, value = pieces[k]
+        if kind == "d":
+            k += 1
+            continue
+        if out == p:
+            return k
+        length = value if kind == "r" else len(value)
+        if out + length > p:
+            cut = p - out
+            if kind == "r":
+                pieces[k:k+1] = [["r", cut], ["r", value-cut]]
+            else:
+                pieces[k:k+1] = [["i", value[:cut]], ["i", value[cut:]]]
+            return k+1
+        out += length
+        k += 1
+
+def _insert(pieces, p, string):
+    k = _seek(pieces, p)
+    if k > 0 and pieces[k-1][0] == "i":
+        pieces[k-1][1] += string
+    elif pieces[k][0] == "i":
+        pieces[k][1] = string + pieces[k][1]
+    else:
+        pieces.insert(k, ["i", string])
+
+def _delete(pieces, p, string):
+    k = _seek(pieces, p)
+    while string:
+        kind, value = pieces[k]
+
+        # already deleted
+        if kind == "d":
+            k += 1
+
+        # delete characters of the original document
+        elif kind == "r":
+            n = min(value, len(string))
+            if n < value:
+                pieces[k+1:k+1] = [["r", value-n]]
+            pieces[k] = ["d", string[:n]]
+            string = string[n:]
+            k += 1
+
+        # delete inserted characters
+        else:
+            n = min(len(value), len(string))
+            if n < len(value):
+                pieces[k][1] = value[n:]
+            else:
+                del pieces[k]
+            string = string[n:]
+
+# merge deletes & inserts at the same position and strip what is deleted and inserted again
+def _normalize(pieces):
+    result = []
+    deleted, inserted = "", ""
+    for kind, value in pieces:
+        if kind == "d":
+            deleted += value
+        elif kind == "i":
+            inserted += value
+        else:
+            if deleted or inserted:
+                prefix = 0
+                maxlen = min(len(deleted), len(inserted))
+                while prefix < maxlen and deleted[prefix] == inserted[prefix]:
+                    prefix += 1
+                suffix = 0
+                while suffix < maxlen - prefix and deleted[-1-suffix] == inserted[-1-suffix]:
+                    suffix += 1
+                _retain(result, prefix)
+                if len(deleted) - suffix > prefix:
+                    result.append(["d", deleted[prefix:len(deleted)-suffix]])
+                if len(inserted) - suffix > prefix:
+                    result.append(["i", inserted[prefix:len(inserted)-suffix]])
+                _retain(result, suffix)
+                deleted, inserted = "", ""
+            _retain(result, value)
+    return result
+
+def _retain(pieces, n):
+    if n == 0:
+        return
+    if pieces and pieces[-1][0] == "r":
+        pieces[-1][1] += n
+    else:
+        pieces.append(["r", n])
+
+def _emit(pieces):
+    ops = []
+    out = 0
+    for kind, value in pieces:
+        if kind == "r":
+            out += value
+        elif kind == "d":
+            ops.append({"p": out, "d": value})
+        else:
+            ops.append({"p": out, "i": value})
+            out += len(value)
+    return ops
+
+
+# -------------- #
+# transformation # (ShareJS text type)
+# -------------- #
+
+# append component to op, merging it with the last component if possible
+def _append(op, c):
+    if c.get("i") == "" or c.get("d") == "":
+        return
+    if op:
+        last = op[-1]
+        if "i" in last and "i" in c and last["p"] <= c["p"] <= last["p"] + len(last["i"]):
+            op[-1] = {"p": last["p"], "i": last["i"][:c["p"]-last["p"]] + c["i"] + last["i"][c["p"]-last["p"]:]}
+            return
+        if "d" in last and "d" in c and c["p"] <= last["p"] <= c["p"] + len(c["d"]):
+            op[-1] = {"p": c["p"], "d": c["d"][:last["p"]-c["p"]] + last["d"] + c["d"][last["p"]-c["p"]:]}
+            return
+    op.append(c)
+
+# position after applying component c
+def _transformPosition(pos, c, insert_after=False):
+    if "i" in c:
+        if c["p"] < pos or c["p"] == pos and insert_after:
+            return pos + len(c["i"])
+        return pos
+    if pos <= c["p"]:
+        return pos
+    if pos <= c["p"] + len(c["d"]):
+        return c["p"]
+    return pos - len(c["d"])
+
+# transform component c against other component and append the result to dest
+def _transformComponent(dest, c, other, side):
+    if "i" in c:
+        _append(dest, {"p": _transformPosition(c["p"], other, side == "right"), "i": c["i"]})
+
+    # delete vs insert
+    elif "i" in other:
+        s = c["d"]
+        if c["p"] < other["p"]:
+            _append(dest, {"p": c["p"], "d": s[:other["p"]-c["p"]]})
+            s = s[other["p"]-c["p"]:]
+        if s:
+            _append(dest, {"p": c["p"] + len(other["i"]), "d": s})
+
+    # delete vs delete
+    elif c["p"] >= other["p"] + len(other["d"]):
+        _append(dest, {"p": c["p"] - len(other["d"]), "d": c["d"]})
+    elif c["p"] + len(c["d"]) <= other["p"]:
+        _append(dest, c)
+    else:
+        d = ""
+        if c["p"] < other["p"]:
+            d = c["d"][:other["p"]-c["p"]]
+        if c["p"] + len(c["d"]) > other["p"] + len(other["d"]):
+            d += c["d"][other["p"]+len(other["d"])-c["p"]:]
+        if d:
+            _append(dest, {"p": _transformPosition(c["p"], other), "d": d})
+    return dest
+
+def transformX(left, right):
+    """
+    Transforms two concurrent ops against each other.
+    Returns (left', right'), such that applying left & right' results in the same document as right & left'.
+    (Inserts of left are placed before inserts of right at the same position.)
+    """
+    new_right = []
+    for c in right:
+        new_left = []
+        k = 0
+        while k < len(left):
+            next_c = []
+            _transformComponent(new_left, left[k], c, "left")
+            _transformComponent(next_c, c, left[k], "right")
+            k += 1
+
+            if len(next_c) == 1:
+                c = next_c[0]
+            elif len(next_c) == 0:
+                for l in left[k:]:
+                    _append(new_left, l)
+                c = None
+                break
+            else:
+                l_, r_ = transformX(left[k:], next_c)
+                for l in l_:
+                    _append(new_left, l)
+                for r in r_:
+                    _append(new_right, r)
+                c = None
+                break
+
+        if c is not None:
+            _append(new_right, c)
+        left = new_left
+    return left, new_right
+
+
+class OTClient:
+
+    def __init__(self, send):
+        """
+        ShareJS-style client state machine for a single document:
+        - synchronized:              no local changes are waiting for the server
+        - awaiting ack:              one op (inflight) has been sent to the server
+        - awaiting ack with buffer:  further local changes (pending) are collected until the ack arrives
+        Remote ops are transformed against inflight & pending ops, such that they can be applied immediately.
+        """
+        self.send = send
+        self.inflight = None
+        self.pending = []
+        self.flush_requested = False
+
+    @property
+    def state(self):
+        if self.inflight is None:
+            return "synchronized"
+        return "awaiting ack with buffer" if self.pending else "awaiting ack"
+
+    # local changes
+    def submit(self, ops):
+        self.pending = compose(self.pending + ops)
+
+    # send pending changes (after the ack if an op is inflight)
+    def flush(self):
+        if self.inflight is not None:
+            self.flush_requested = True
+            return
+        self.flush_requested = False
+        if self.pending:
+            self.inflight, self.pending = self.pending, []
+            self.send(self.inflight)
+
+    # server accepted inflight op
+    # (flush=False keeps a requested flush for later, e.g. while missed updates are replayed)
+    def ack(self, flush=True):
+        self.inflight = None
+        if flush and self.flush_requested:
+            self.flush()
+
+    # connection has been lost before the ack arrived
+    def resend(self):
+        if self.inflight is not None:
+            self.send(self.inflight)
+
+    # remote changes, returns the ops to apply locally
+    def receive(self, ops):
+        if self.inflight is not None:
+            self.inflight, ops = transformX(self.inflight, ops)
+        if self.pending:
+            self.pending, ops = transformX(self.pending, ops)
+        return ops
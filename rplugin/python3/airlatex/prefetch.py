@@ -0,0 +1,116 @@
+from asyncio import PriorityQueue, create_task, get_event_loop
+from itertools import count
+from logging import getLogger
+from airlatex.util import Stats
+
+
+class Prefetcher:
+
+    def __init__(self, handler, limit=0, max_size=512, concurrency=2, extensions=("tex",)):
+        """
+        Loads documents of a project in the background, such that opening them is instant:
+        - when the project is joined, the main document & up to limit documents with the given
+          extensions are queued (main document first, then in tree order)
+        - at most concurrency documents are fetched at once (joinDoc & leaveDoc)
+        - documents larger than max_size kilobytes are not kept
+        - opening a document takes it from the cache (waiting if it is being fetched, skipping
+          it if it is still queued); the server then only sends the updates since the cached version
+        - fetch loads a document right away (e.g. for searching), tracked & cached the same way
+        """
+        self.handler = handler
+        self.limit = limit
+        self.max_size = max_size * 1024
+        self.concurrency = concurrency
+        self.extensions = extensions
+        self.queue = PriorityQueue()
+        self.order = count()
+        self.queued = set()
+        self.fetching = {}
+        self.cache = {}
+        self.workers = []
+        self.stats = Stats()
+        self.log = getLogger("AirLatex")
+
+    # documents of the project tree in tree order
+    def _documents(self, folder):
+        yield from folder["docs"]
+        for subfolder in folder["folders"]:
+            yield from self._documents(subfolder)
+
+    async def _worker(self):
+        while True:
+            priority, _, doc_id = await self.queue.get()
+            if doc_id not in self.queued:
+                continue
+            try:
+                with self.stats.timer("prefetch"):
+                    await self._fetch(doc_id)
+                if doc_id in self.cache:
+                    self.stats.add("prefetched size", self.cache[doc_id]["size"] / 1024, "kB")
+            except Exception as e:
+                self.log.debug("Prefetching document %s failed: %s", doc_id, repr(e))
+
+    # opening the document meanwhile waits for the fetch (see take)
+    async def _fetch(self, doc_id):
+        self.queued.discard(doc_id)
+        self.fetching[doc_id] = future = get_event_loop().create_future()
+        try:
+
+            # document does not need to be watched until it is opened
+            document = await self.handler.fetchDocument(doc_id)
+            document["size"] = sum(len(l)+1 for l in document["lines"])
+            if document["size"] > self.max_size:
+                self.log.debug("Fetched document %s is too large to be kept (%i bytes).", doc_id, document["size"])
+            else:
+                self.cache[doc_id] = document
+        finally:
+            del self.fetching[doc_id]
+            future.set_result(None)
+        return document
+
+
+    # --- #
+    # api # (to be used by AirLatexProject)
+    # --- #
+
+    def start(self, project):
+        if self.limit <= 0 or "rootFolder" not in project:
+            return
+        candidates = [doc for doc in self._documents(project["rootFolder"][0]) if doc["name"].split(".")[-1] in self.extensions]
+        candidates.sort(key=lambda doc: doc["_id"] != project.get("rootDoc_id"))
+        for doc in candidates[:self.limit]:
+            self.schedule(doc["_id"])
+        while len(self.workers) < self.concurrency:
+            self.workers.append(create_task(self._worker()))
+
+    # lower priority values are fetched first
+    # (documents that are joined already are skipped, as prefetching leaves them afterwards)
+    def schedule(self, doc_id, priority=1):
+        if doc_id in self.cache or doc_id in self.fetching or doc_id in self.queued:
+            return
+        if doc_id in self.handler.documents or self.handler.remote.tracks(doc_id):
+            return
+        self.queued.add(doc_id)
+        self.queue.put_nowait((priority, next(self.order), doc_id))
+
+    # current lines & version of a document (fetched now, or by the fetch that is running)
+    async def fetch(self, doc_id):
+        while doc_id in self.fetching:
+            await self.fetching[doc_id]
+            if doc_id in self.cache:
+                return self.cache[doc_id]
+        return await self._fetch(doc_id)
+
+    # cached document (or None), removed from the cache as the document is joined from now on
+    async def take(self, doc_id):
+        self.queued.discard(doc_id)
+        if doc_id in self.fetching:
+            await self.fetching[doc_id]
+        entry = self.cache.pop(doc_id, None)
+        self.stats.add("cache hits" if entry is not None else "cache misses", 1)
+        return entry
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
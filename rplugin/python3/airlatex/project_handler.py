@@ -1,77 +1,96 @@
 import pynvim
-from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado import gen
 from tornado.websocket import websocket_connect
-import re
-from itertools import count
-import json
 from airlatex.util import _genTimeStamp
+from airlatex import protocol
+from airlatex.prefetch import Prefetcher
+from airlatex.tree import ProjectIndex
+from airlatex.remotedocs import RemoteDocuments
 import time
-from tornado.locks import Lock, Event
+from tornado.locks import Lock
 from logging import DEBUG
 from tornado.httpclient import HTTPRequest
-from asyncio import Queue, wait_for, TimeoutError
+from asyncio import TimeoutError, create_task
 from logging import getLogger
 from asyncio import sleep
 
-codere = re.compile(r"(\d):(?:(\d+)(\+?))?:(?::(?:(\d+)(\+?))?(.*))?")
-# code, await_id, await_mult, answer_id, answer_mult, msg = codere.match(str).groups()
-# code        : m[0]
-# await_id    : m[1]
-# await_mult  : m[2]
-# answer_id   : m[3]
-# answer_mult : m[5]
-# msg         : m[5]
-
 class AirLatexProject:
 
-    def __init__(self, url, project, used_id, sidebar, cookie=None, wait_for=15):
+    def __init__(self, url, project, used_id, sidebar, cookie=None, wait_for=15, compression=None, prefetch={}, snapshots=None):
         project["handler"] = self
 
         self.sidebar = sidebar
-        self.ioloop = IOLoop()
         self.used_id = used_id
         self.project = project
         self.url = url
         self.wait_for = wait_for if str(wait_for).isnumeric() else None
         self.cookie = cookie
         self.url_base = url.split("/")[2]
-        self.command_counter = count(1)
+        self.compression = compression
         self.ws = None
-        self.requests = {}
+        self.requests = protocol.RequestTable()
         self.cursors = {}
         self.documents = {}
         self.log = getLogger("AirLatex")
-        self.ops_queue = Queue()
+        self.inflight = set()
+        self.prefetcher = Prefetcher(self, **prefetch)
+        self.snapshots = snapshots
+        self.remote = RemoteDocuments(self)
+        self.mirror = None
+        self.search = None
+        self.index = ProjectIndex()
+
+        # reconnecting (the client id identifies our own updates, see DocumentBuffer.sent_under)
+        self.reconnect = True
+        self.accepted = False
+        self.public_id = None
+
+        # heartbeat (timeout of the socket.io handshake & observed interval of the server's heartbeats)
+        self.heartbeat_timeout = None
+        self.server_heartbeat = None
+        self.last_sent = self.last_received = self.last_heartbeat = time.monotonic()
+
+        # bytes on the wire & payload bytes of all closed connections
+        self.traffic = {"wire in": 0, "payload in": 0, "wire out": 0, "payload out": 0}
 
     async def start(self):
         self.log.debug("Starting connection to server.")
-        # start tornado event loop & related callbacks
-        IOLoop.current().spawn_callback(self.sendOps_flush)
-        PeriodicCallback(self.keep_alive, 20000).start()
+        self.accepted = False
+        # runs on the plugin's event loop, heartbeats are sent by the ConnectionManager
         await self.connect()
-        await self.ioloop.start()
 
-    async def send(self,message_type,message=None,event=None):
+    # commands return a future resolving to the answer of the server
+    async def send(self,message_type,message=None,timeout=None):
+        if self.ws is None:
+            self.log.debug("Not connected. Dropping message of type '%s'.", message_type)
+            return
+        self.last_sent = time.monotonic()
         if message_type == "keep_alive":
             self.log.debug("Send keep_alive.")
             self.ws.write_message("2::")
             return
         assert message is not None
-        message_content = json.dumps(message) if isinstance(message, dict) else message
-        message["event"] = event
+        message_content = protocol.dumps(message) if isinstance(message, dict) else message
         if message_type == "update":
-            self.log.debug("Sending update: "+message_content)
+            self.log.debug("Sending update: %s", message_content)
             self.ws.write_message("5:::"+message_content)
         elif message_type == "cmd":
-            cmd_id = next(self.command_counter)
-            msg = "5:" + str(cmd_id) + "+::" + message_content
-            self.log.debug("Sendng cmd: "+msg)
-            self.requests[str(cmd_id)] = message
+            cmd_id, future = self.requests.add(message, timeout)
+            msg = "5:" + cmd_id + "+::" + message_content
+            self.log.debug("Sendng cmd: %s", msg)
             self.ws.write_message(msg)
+            return future
+
+    # send command & wait for the answer
+    # (raises TimeoutError, or ConnectionError if the connection is lost)
+    async def call(self, message, timeout=None):
+        future = await self.send("cmd", message, timeout=timeout)
+        if future is None:
+            raise ConnectionError("Not connected.")
+        return await future
 
     async def sidebarMsg(self, msg):
-        self.log.debug_gui("sidebarMsg: %s" % msg)
+        self.log.debug_gui("sidebarMsg: %s", msg)
         self.project["msg"] = msg
         await self.sidebar.triggerRefresh()
 
@@ -83,13 +102,45 @@ class AirLatexProject:
         if doc_id in self.documents:
             doc = self.documents[doc_id]
             buf = doc["buffer"]
-            self.log.debug_gui("bufferDo cmd="+command)
+            self.log.debug_gui("bufferDo cmd=%s", command)
             if command == "applyUpdate":
                 buf.applyUpdate(data)
             elif command == "write":
                 buf.write(data)
             elif command == "updateRemoteCursor":
                 buf.updateRemoteCursor(data)
+            elif command == "ack":
+                buf.onAck()
+            elif command == "catchUp":
+                buf.catchUp(*data)
+
+    def treeEvent(self, name, args):
+
+        # local mirror follows the tree (files at the paths before the change are removed)
+        entity_id = args[1]["_id"] if name in ("reciveNewDoc", "reciveNewFile", "reciveNewFolder") else args[0]
+        old_paths = self.mirror.paths(entity_id) if self.mirror is not None else {}
+        changed = self._updateIndex(name, args)
+        if changed and self.mirror is not None:
+            self.mirror.treeChanged(entity_id, old_paths)
+        return changed
+
+    def _updateIndex(self, name, args):
+        if name == "reciveNewDoc":
+            return self.index.addEntity(args[0], args[1], "file")
+        elif name == "reciveNewFile":
+            return self.index.addEntity(args[0], args[1], "fileRef")
+        elif name == "reciveNewFolder":
+            folder = args[1]
+            for key in ("docs", "fileRefs", "folders"):
+                folder.setdefault(key, [])
+            return self.index.addEntity(args[0], folder, "folder")
+        elif name == "reciveEntityRename":
+            return self.index.renameEntity(args[0], args[1])
+        elif name == "removeEntity":
+            return self.index.removeEntity(args[0])
+        elif name == "reciveEntityMove":
+            return self.index.moveEntity(args[0], args[1])
+        return False
 
     async def updateRemoteCursor(self, cursors):
         for cursor in cursors:
@@ -97,7 +148,6 @@ class AirLatexProject:
                 await self.bufferDo(cursor["doc_id"], "updateRemoteCursor", cursor)
 
     async def updateCursor(self,doc, pos):
-        event = Event()
         await self.send("update",{
             "name":"clientTracking.updatePosition",
             "args": [{
@@ -105,101 +155,63 @@ class AirLatexProject:
                 "row": pos[0]-1,
                 "column": pos[1]
             }]
-        }, event=event)
-
-    # wrapper for the ioloop
-    async def sendOps(self, document, content_hash, ops=[]):
-        await self.ops_queue.put((document, content_hash, ops))
-
-    # actual sending of ops
-    async def _sendOps(self, document, content_hash, ops=[]):
-
-        # append new ops to buffer
-        document["ops_buffer"] += ops
+        })
 
-        # skip if nothing to do
-        if len(document["ops_buffer"]) == 0:
+    # send changes of a document and wait for the server to accept them
+    # (every document is sent independently, its ot client keeps at most one update inflight)
+    # (version is the document version the ops are based on, dup_sources the client ids of the
+    # connections the ops have been sent on before)
+    async def sendOps(self, document, version, content_hash, ops, dup_sources=()):
+        doc_id = document["_id"]
+        if self.ws is None:
+            self.log.debug("Not connected. Changes to document %s are sent after reconnecting.", doc_id)
             return
-
-        # wait if awaiting server response
-        event = Event()
-        await self.gui_await(True)
-
-        # clean buffer for next call
-        ops_buffer, document["ops_buffer"] = document["ops_buffer"], []
-
-        # actually send operations
-        source = document["_id"]
-
         obj_to_send = {
-            "doc": document["_id"],
+            "doc": doc_id,
             # "meta": {
             #     "source": source,
             #     "ts": _genTimeStamp(),
             #     "user_id": self.used_id
             # },
-            "op": ops_buffer,
-            "v": document["version"],
-            "lastV": document["version"]-1,
-            "hash": content_hash # overleaf/web: sends document hash (if it hasn't been sent in the last 5 seconds)
+            "op": ops,
+            "v": version,
+            "lastV": version-1,
         }
 
+        # overleaf/web: sends document hash (if it hasn't been sent in the last 5 seconds)
+        if content_hash is not None:
+            obj_to_send["hash"] = content_hash
+
+        # resent changes may have been applied before a reconnect, the server drops them in that case
+        if dup_sources:
+            obj_to_send["dupIfSource"] = dup_sources
+
         # notify server of local change
-        self.log.debug("Sending %i changes to document %s (ver %i)." % (len(ops_buffer), document["_id"], document["version"]))
-        await self.send("cmd",{
+        # (written before anything is awaited, such that no update of the document is handled in between)
+        self.log.debug("Sending %i changes to document %s (ver %i).", len(ops), doc_id, version)
+        future = await self.send("cmd", {
             "name":"applyOtUpdate",
             "args": [
-                document["_id"],
+                doc_id,
                 obj_to_send
             ]
-        }, event=event)
-
-        # server needs to answer before proceeding
-        if self.wait_for is None:
-            await event.wait
-        else:
-            try:
-                await wait_for(event.wait(), timeout=self.wait_for)
-            except TimeoutError:
-                await self.disconnect("Error: The server did not answer for %d seconds." % self.wait_for)
-        await self.gui_await(False)
-        self.log.debug(" -> Waiting for server to accept changes  changes to documet %s (ver %i)-> done" % (document["_id"], document["version"]))
-
-    # sendOps whenever events appear in queue
-    # (is only called in constructor)
-    async def sendOps_flush(self):
-
-        # direct sending
-        # async for document, ops in self.ops_queue:
-        #     await self._sendOps(document, ops)
-
-        # collects ops and sends them in a batch, server is ready
-        while True:
-            all_ops = {}
-
-            # await first element
-            document, content_hash, ops = await self.ops_queue.get()
-            if document["_id"] not in all_ops:
-                all_ops[document["_id"]] = ops
-            else:
-                all_ops[document["_id"]] += ops
-
-            # get also all other elements that are currently in queue
-            num = self.ops_queue.qsize()
-            for i in range(num):
-                document, content_hash, ops = await self.ops_queue.get()
-                if document["_id"] not in all_ops:
-                    all_ops[document["_id"]] = ops
-                else:
-                    all_ops[document["_id"]] += ops
-
-            # apply all ops one after another
-            for doc_id, ops in all_ops.items():
-                document = self.documents[doc_id]
-                await self._sendOps(document, content_hash, ops)
-
-
+        }, timeout=self.wait_for)
+        self.inflight.add(doc_id)
+        await self.gui_await(True)
 
+        # server needs to answer before the next changes of this document are sent
+        try:
+            await future
+        except TimeoutError:
+            await self.disconnect("Error: The server did not answer for %d seconds." % self.wait_for, reconnect=True)
+            return
+        except ConnectionError:
+            self.log.debug(" -> Connection lost before the server accepted changes to document %s (resent after reconnecting)", doc_id)
+            return
+        finally:
+            self.inflight.discard(doc_id)
+            await self.gui_await(len(self.inflight) > 0)
+        self.log.debug(" -> Waiting for server to accept changes to document %s (ver %i) -> done", doc_id, document["version"])
 
     async def joinDocument(self, buffer):
 
@@ -207,37 +219,127 @@ class AirLatexProject:
         doc = buffer.document
         doc["buffer"] = buffer
 
+        # prefetched (waits if it is being prefetched right now) or joined without buffer
+        cached = await self.prefetcher.take(doc["_id"])
+        cached = await self.remote.release(doc["_id"]) or cached
+
         # register document in project_handler
         self.documents[doc["_id"]] = doc
 
-        # register document op-buffer
-        self.documents[doc["_id"]]["ops_buffer"] = []
+        # prefetched => show it immediately & get the updates since
+        if cached is not None:
+            doc["version"] = cached["version"]
+            buffer.write(cached["lines"])
+            await self.rejoinDocument(doc)
+            return
 
-        # regester for document-watching
-        await self.send("cmd",{
-            "name":"joinDoc",
-            "args": [
-                doc["_id"],
-                {"encodeRanges": True}
-            ]
-        })
+        # snapshot of a previous session => show it read-only until the server sent the updates since
+        # (also works as offline view while the server is not reachable)
+        snapshot = await self.snapshots.load(self.project["id"], doc["_id"]) if self.snapshots else None
+        if snapshot is not None:
+            doc["version"] = snapshot["version"]
+            buffer.write(snapshot["lines"], readonly=True)
+            await self.rejoinDocument(doc)
+            return
+
+        # regester for document-watching (returns once the answer has been handled,
+        # the buffer write it triggers is scheduled through nvim.async_call)
+        await self._joinDoc(doc, [doc["_id"], {"encodeRanges": True}])
+
+    # wait until the server accepted the local changes of all documents
+    # (returns False if that did not happen within timeout seconds)
+    async def synced(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while any(doc["buffer"].client.inflight is not None or doc["buffer"].client.pending for doc in self.documents.values()):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            await sleep(0.05)
+        return True
+
+    # content of a document without watching it (joinDoc & leaveDoc)
+    # (use Prefetcher.fetch, such that opening the document waits for it)
+    async def fetchDocument(self, doc_id):
+        data = await self.call({"name":"joinDoc", "args": [doc_id, {"encodeRanges": True}]}, timeout=self.wait_for)
+
+        # opened or joined without buffer meanwhile => keep watching it
+        if doc_id not in self.documents and not self.remote.tracks(doc_id):
+            await self.call({"name":"leaveDoc", "args": [doc_id]}, timeout=self.wait_for)
+        if data[0] is not None:
+            raise ConnectionError(str(data[0]))
+        return {"lines": [d.encode("latin1").decode("utf8") for d in data[1]], "version": data[2]}
+
+    async def rejoinDocument(self, doc):
+
+        # document not loaded yet => join from scratch
+        if "version" not in doc:
+            await self.joinDocument(doc["buffer"])
+            return
 
-    async def disconnect(self, msg="Disconnected."):
+        # server sends the updates since the known version
+        self.log.debug("Rejoining document %s (ver %i).", doc["_id"], doc["version"])
+        await self._joinDoc(doc, [doc["_id"], doc["version"], {"encodeRanges": True}])
+
+    async def _joinDoc(self, doc, args):
+        try:
+            await self.call({"name":"joinDoc", "args": args}, timeout=self.wait_for)
+        except TimeoutError:
+            await self.disconnect("Error: The server did not answer for %d seconds." % self.wait_for, reconnect=True)
+        except ConnectionError:
+            self.log.debug("Connection lost while joining document %s (joined after reconnecting).", doc["_id"])
+
+    # requests of a dropped connection will never be answered
+    def connectionLost(self):
+        self._dropSocket()
+        self.requests.cancel(ConnectionError("Connection lost."))
+
+    def _dropSocket(self, close=False):
+        if self.ws is None:
+            return
+        for key, value in self._socketTraffic().items():
+            self.traffic[key] += value
+        if close:
+            self.ws.close()
+        self.ws = None
+
+    # byte counters of tornado's websocket protocol (payload is counted uncompressed)
+    def _socketTraffic(self):
+        protocol = getattr(self.ws, "protocol", None)
+        return {
+            "wire in": getattr(protocol, "_wire_bytes_in", 0),
+            "payload in": getattr(protocol, "_message_bytes_in", 0),
+            "wire out": getattr(protocol, "_wire_bytes_out", 0),
+            "payload out": getattr(protocol, "_message_bytes_out", 0),
+        }
+
+    # traffic of all connections so far
+    def trafficStats(self):
+        traffic = dict(self.traffic)
+        if self.ws is not None:
+            for key, value in self._socketTraffic().items():
+                traffic[key] += value
+        return traffic
+
+    async def disconnect(self, msg="Disconnected.", reconnect=False):
         # del self.project["handler"]
-        self.log.debug("Connection Closed. Reason:" + msg)
+        self.log.debug("Connection Closed. Reason:%s", msg)
+        self.reconnect = reconnect
         self.project["msg"] = msg
-        self.project["open"] = False
-        self.project["connected"] = False
+        if not reconnect:
+            self.project["open"] = False
+            self.project["connected"] = False
+            self.prefetcher.stop()
         await self.sidebar.triggerRefresh()
-        # await self.ioloop.stop()
+        self._dropSocket(close=True)
 
     async def connect(self):
         try:
             await self.sidebarMsg("Connecting Websocket.")
             self.project["connected"] = True
-            self.log.debug("Initializing websocket connection to "+self.url)
+            self.log.debug("Initializing websocket connection to %s", self.url)
             request = HTTPRequest(self.url, headers={'Cookie': self.cookie})
-            self.ws = await websocket_connect(request)
+            self.ws = await websocket_connect(request, compression_options=self.compression)
+            self.last_sent = self.last_received = self.last_heartbeat = time.monotonic()
+            self.server_heartbeat = None
         except Exception as e:
             await self.sidebarMsg("Connection Error: "+str(e))
         else:
@@ -246,24 +348,25 @@ class AirLatexProject:
 
     async def run(self):
         try:
-            while True:
+            while self.ws is not None:
                 msg = await self.ws.read_message()
 
                 if msg is None:
                     break
-                self.log.debug("Raw server answer: "+msg)
+                self.last_received = time.monotonic()
+                self.log.debug("Raw server answer: %s", msg)
 
                 # parse the code
-                code, await_id, await_mult, answer_id, answer_mult, data = codere.match(msg).groups()
+                code, await_id, answer_id, data = protocol.parseFrame(msg)
                 if data:
                     try:
-                        data = json.loads(data)
+                        data = protocol.loads(data)
                     except:
                         data = {"name":"error"}
 
                 # error occured
                 if code == "0":
-                    await self.disconnect("Error: The server closed the connection.")
+                    await self.disconnect("Error: The server closed the connection.", reconnect=True)
 
                 # first message
                 elif code == "1":
@@ -271,7 +374,10 @@ class AirLatexProject:
 
                 # keep alive
                 elif code == "2":
-                    self.keep_alive()
+                    interval = self.last_received - self.last_heartbeat
+                    self.server_heartbeat = interval if self.server_heartbeat is None else max(interval, 0.9*self.server_heartbeat)
+                    self.last_heartbeat = self.last_received
+                    await self.keep_alive()
 
                 # server request
                 elif code == "5":
@@ -280,6 +386,8 @@ class AirLatexProject:
 
                     # connection accepted => join Project
                     if data["name"] == "connectionAccepted":
+                        if len(data.get("args", [])) > 1:
+                            self.public_id = data["args"][1]
                         await self.sidebarMsg("Connection Active.")
                         await self.send("cmd",{"name":"joinProject","args":[{"project_id":self.project["id"]}]})
 
@@ -308,10 +416,17 @@ class AirLatexProject:
                         if "args" not in data:
                             return
 
-                        # apply update to buffer
+                        # apply update to buffer (or to the document joined without buffer)
                         for op in data["args"]:
+                            if op["doc"] not in self.documents:
+                                self.remote.applyUpdate(op)
                             await self.bufferDo(op["doc"], "applyUpdate", op)
 
+                    # project tree changed => update index & sidebar
+                    elif data["name"] in ("reciveNewDoc", "reciveNewFile", "reciveNewFolder", "reciveEntityRename", "removeEntity", "reciveEntityMove"):
+                        if self.treeEvent(data["name"], data.get("args", [])):
+                            await self.sidebar.triggerRefresh()
+
                     # error occured
                     elif data["name"] == "otUpdateError":
                         await self.disconnect("Error occured on operation Update: " + data["args"][0])
@@ -324,23 +439,49 @@ class AirLatexProject:
                 elif code == "6":
 
                     # get request command
-                    request = self.requests[answer_id]
+                    request = self.requests.resolve(answer_id, data)
+                    if request is None:
+                        self.log.debug("Answer to unknown request %s.", answer_id)
+                        continue
                     cmd = request["name"]
 
                     # joinProject => server lists project information
                     if cmd == "joinProject":
                         project_info = data[1]
-                        if self.log.level == DEBUG:
-                            self.log.debug(json.dumps(project_info))
+                        if self.log.isEnabledFor(DEBUG):
+                            self.log.debug(protocol.dumps(project_info))
                         self.project.update(project_info)
                         self.project["open"] = True
+                        self.index.build(self.project["rootFolder"][0])
+                        self.accepted = True
+                        self.prefetcher.start(self.project)
                         await self.send("cmd",{"name":"clientTracking.getConnectedUsers"})
                         await self.sidebar.triggerRefresh()
 
+                        # reconnected => catch up on joined documents
+                        for doc in list(self.documents.values()):
+                            create_task(self.rejoinDocument(doc))
+                        create_task(self.remote.rejoin())
+
                     elif cmd == "joinDoc":
                         id = request["args"][0]
-                        self.documents[id]["version"] = data[2]
-                        await self.bufferDo(id, "write", [d.encode("latin1").decode("utf8") for d in data[1]])
+
+                        # prefetched or joined without buffer => answer is handled there
+                        if id not in self.documents:
+                            pass
+
+                        # rejoined from known version => replay missed updates
+                        elif len(request["args"]) == 3 and data[0] is None:
+                            await self.bufferDo(id, "catchUp", (data[3], data[2]))
+
+                        # missed updates are not available anymore => reload document
+                        elif len(request["args"]) == 3:
+                            self.log.info("Could not rejoin document %s: %s", id, str(data[0]))
+                            create_task(self._joinDoc(self.documents[id], [id, {"encodeRanges": True}]))
+
+                        else:
+                            self.documents[id]["version"] = data[2]
+                            await self.bufferDo(id, "write", [d.encode("latin1").decode("utf8") for d in data[1]])
 
                     elif cmd == "applyOtUpdate":
                         id = request["args"][0]
@@ -348,11 +489,8 @@ class AirLatexProject:
                         # version increase should be before next event
                         self.documents[id]["version"] += 1
 
-                        # flush next
-                        request["event"].set()
-
-                        # remove awaiting request
-                        del self.requests[answer_id]
+                        # ot client may send pending changes
+                        await self.bufferDo(id, "ack", None)
 
                     elif cmd == "clientTracking.getConnectedUsers":
                         for cursor in data[1]:
@@ -363,9 +501,12 @@ class AirLatexProject:
                             self.cursors[cursor["client_id"]] = cursor
                         await self.updateRemoteCursor(data[1])
 
+                    elif cmd == "leaveDoc":
+                        pass
+
                     elif cmd == "clientTracking.updatePosition":
                         # server accepted the change
-                        del self.requests[answer_id]
+                        pass
 
                     else:
                         await self.sidebarMsg("Data not known:"+str(msg))
@@ -0,0 +1,144 @@
+import json
+from itertools import count
+from logging import getLogger
+from asyncio import get_event_loop, TimeoutError
+
+# socket.io 0.9 frames have the form "code:id:endpoint:data"
+#   code     : 0 disconnect, 1 connect, 2 heartbeat, 5 event, 6 ack, 7 error, ...
+#   id       : message id ("+" appended if the sender awaits an ack)
+#   endpoint : unused by overleaf
+#   data     : for acks "ackid+json", else json (or text)
+
+def parseFrame(msg):
+    """
+    Splits a socket.io frame by its separators (no regular expression involved).
+    Returns code, message id, ack id (answers to our requests only) and data (unparsed).
+    """
+    parts = msg.split(":", 3)
+    code = parts[0]
+    msg_id = parts[1].rstrip("+") or None if len(parts) > 1 else None
+    data = parts[3] if len(parts) > 3 else None
+
+    # ack: "ackid+json"
+    ack_id = None
+    if code == "6" and data:
+        ack_id, _, data = data.partition("+")
+    return code, msg_id, ack_id, data or None
+
+# handshake answer of the form "sid:heartbeat timeout:close timeout:transports"
+# (timeouts in seconds, empty if disabled; the close timeout only concerns the server's session
+# after a disconnect and is not returned)
+def parseHandshake(text):
+    parts = text.strip().split(":")
+    parts += [""] * (4 - len(parts))
+    heartbeat = int(parts[1]) if parts[1].isdigit() else None
+    return parts[0], heartbeat, parts[3].split(",") if parts[3] else []
+
+
+# ---------- #
+# json codec #
+# ---------- #
+
+def _stdlibCodec():
+    return json.loads, json.dumps
+
+def _orjsonCodec():
+    import orjson
+    return orjson.loads, lambda obj: orjson.dumps(obj).decode()
+
+def _ujsonCodec():
+    import ujson
+    return ujson.loads, lambda obj: ujson.dumps(obj, ensure_ascii=False)
+
+json_backends = {
+    "json": _stdlibCodec,
+    "orjson": _orjsonCodec,
+    "ujson": _ujsonCodec,
+}
+
+json_backend = "json"
+loads, dumps = _stdlibCodec()
+
+def setJSONBackend(name="auto"):
+    """
+    Selects the json implementation used for all messages.
+    "auto" uses the fastest one installed (orjson, ujson, json).
+    """
+    global json_backend, loads, dumps
+    candidates = ["orjson", "ujson", "json"] if name == "auto" else [name]
+    for candidate in candidates:
+        if candidate not in json_backends:
+            raise ValueError("Unknown json backend '%s'." % candidate)
+        try:
+            loads, dumps = json_backends[candidate]()
+        except ImportError:
+            getLogger("AirLatex").info("json backend '%s' is not installed.", candidate)
+            continue
+        json_backend = candidate
+        break
+    return json_backend
+
+
+# ------------- #
+# request table #
+# ------------- #
+
+class RequestTable:
+
+    def __init__(self, max_size=1000):
+        """
+        Requests awaiting an answer of the server, keyed by message id.
+        - every request gets a future that resolves to the answer
+        - requests time out individually & are cancelled all at once if the connection is lost
+        - at most max_size requests are kept (the oldest one is cancelled if necessary)
+        """
+        self.max_size = max_size
+        self.ids = count(1)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    # register message, returns message id & future
+    def add(self, message, timeout=None):
+        if len(self.entries) >= self.max_size:
+            oldest = next(iter(self.entries))
+            self._fail(oldest, ConnectionError("Too many requests awaiting an answer."))
+
+        loop = get_event_loop()
+        msg_id = str(next(self.ids))
+        future = loop.create_future()
+        future.add_done_callback(_retrieve)
+        handle = loop.call_later(timeout, self._fail, msg_id, TimeoutError()) if timeout is not None else None
+        self.entries[msg_id] = (message, future, handle)
+        return msg_id, future
+
+    # answer arrived, returns the message (or None if not awaited anymore)
+    def resolve(self, msg_id, data):
+        if msg_id not in self.entries:
+            return None
+        message, future, handle = self.entries.pop(msg_id)
+        if handle is not None:
+            handle.cancel()
+        if not future.done():
+            future.set_result(data)
+        return message
+
+    # cancel all requests
+    def cancel(self, exception):
+        for msg_id in list(self.entries):
+            self._fail(msg_id, exception)
+
+    def _fail(self, msg_id, exception):
+        if msg_id not in self.entries:
+            return
+        message, future, handle = self.entries.pop(msg_id)
+        if handle is not None:
+            handle.cancel()
+        if not future.done():
+            future.set_exception(exception)
+
+# failed requests nobody waits for are no unhandled errors
+def _retrieve(future):
+    if not future.cancelled():
+        future.exception()
@@ -0,0 +1,160 @@
+from asyncio import Semaphore, gather, get_event_loop
+from logging import getLogger
+
+
+class RemoteDocuments:
+
+    def __init__(self, handler, concurrency=4):
+        """
+        Documents joined without a buffer (used by the mirror & the search index):
+        - documents are joined on request & kept up to date by applying the server's
+          updates (otUpdateApplied) to their text
+        - listeners are called with the document id after every change
+        - opening a document hands its state over to the buffer (see release)
+        - at most concurrency documents are joined at once
+        """
+        self.handler = handler
+        self.semaphore = Semaphore(concurrency)
+        self.texts = {}
+        self.listeners = []
+        self.log = getLogger("AirLatex")
+
+
+    # ------- #
+    # helpers #
+    # ------- #
+
+    def _apply(self, entry, update):
+        if update.get("v", entry["version"]) < entry["version"]:
+            return
+        text = entry["text"]
+        for op in update.get("op", []):
+            if "i" in op:
+                text = text[:op["p"]] + op["i"] + text[op["p"]:]
+            elif "d" in op:
+                text = text[:op["p"]] + text[op["p"]+len(op["d"]):]
+        entry["text"] = text
+        entry["version"] = update.get("v", entry["version"]) + 1
+
+    def _changed(self, doc_id):
+        for listener in self.listeners:
+            listener(doc_id)
+
+    async def _join(self, doc_id, entry, semaphore):
+        async with semaphore:
+            handler = self.handler
+            cached = await handler.prefetcher.take(doc_id)
+            if self.texts.get(doc_id) is not entry:
+                return
+
+            # prefetched => only the updates since are needed
+            data = None
+            if cached is not None:
+                data = await handler.call({"name":"joinDoc", "args": [doc_id, cached["version"], {"encodeRanges": True}]}, timeout=handler.wait_for)
+                if data[0] is not None:
+                    data = None
+            if data is None:
+                cached = None
+                data = await handler.call({"name":"joinDoc", "args": [doc_id, {"encodeRanges": True}]}, timeout=handler.wait_for)
+            if data[0] is not None:
+                raise ConnectionError(str(data[0]))
+
+            # opened meanwhile => buffer takes over
+            if self.texts.get(doc_id) is not entry:
+                return
+
+            if cached is not None:
+                entry["text"], entry["version"] = "\n".join(cached["lines"]), cached["version"]
+                updates = data[3]
+            else:
+                entry["text"], entry["version"] = "\n".join(d.encode("latin1").decode("utf8") for d in data[1]), data[2]
+                updates = []
+            for update in updates + entry.pop("pending"):
+                self._apply(entry, update)
+
+    async def _rejoin(self, doc_id, entry):
+        handler = self.handler
+        async with self.semaphore:
+            data = await handler.call({"name":"joinDoc", "args": [doc_id, entry["version"], {"encodeRanges": True}]}, timeout=handler.wait_for)
+        if self.texts.get(doc_id) is not entry:
+            return
+        if data[0] is not None:
+            del self.texts[doc_id]
+            await self.join(doc_id)
+        else:
+            for update in data[3]:
+                self._apply(entry, update)
+        self._changed(doc_id)
+
+
+    # --- #
+    # api # (to be used by AirLatexProject, ProjectMirror & ProjectSearch)
+    # --- #
+
+    async def join(self, doc_id, semaphore=None):
+        """
+        Text of the document (joining it, if it is not known yet) or None if it could not be joined.
+        (semaphore limits the joins of the caller instead of the shared concurrency)
+        """
+        entry = self.texts.get(doc_id)
+        if entry is not None:
+            if entry["text"] is None:
+                await entry["loaded"]
+            return entry["text"]
+
+        entry = self.texts[doc_id] = {"text": None, "version": None, "pending": [], "loaded": get_event_loop().create_future()}
+        try:
+            await self._join(doc_id, entry, semaphore or self.semaphore)
+        except Exception:
+            if self.texts.get(doc_id) is entry:
+                del self.texts[doc_id]
+            raise
+        finally:
+            entry["loaded"].set_result(None)
+        return entry["text"]
+
+    def text(self, doc_id):
+        entry = self.texts.get(doc_id)
+        return entry["text"] if entry is not None else None
+
+    async def rejoin(self):
+        """
+        Catches up on the joined documents after a reconnect.
+        """
+        results = await gather(*[self._rejoin(doc_id, entry) for doc_id, entry in list(self.texts.items()) if entry["version"] is not None], return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                self.log.info("Could not rejoin document: %s", repr(result))
+
+    def applyUpdate(self, update):
+        """
+        Update of a joined document (otUpdateApplied).
+        """
+        entry = self.texts.get(update["doc"])
+        if entry is None:
+            return
+        if entry["text"] is None:
+            entry["pending"].append(update)
+            return
+        self._apply(entry, update)
+        self._changed(update["doc"])
+
+    async def release(self, doc_id):
+        """
+        Document is opened, its buffer takes over.
+        Returns the known state (as prefetched document) or None.
+        (waits if the document is being joined, such that the answer is not taken for the buffer's)
+        """
+        entry = self.texts.get(doc_id)
+        if entry is None:
+            return None
+        if entry["text"] is None:
+            await entry["loaded"]
+        if self.texts.get(doc_id) is entry:
+            del self.texts[doc_id]
+        if entry["text"] is None:
+            return None
+        return {"lines": entry["text"].split("\n"), "version": entry["version"]}
+
+    def tracks(self, doc_id):
+        return doc_id in self.texts
@@ -0,0 +1,136 @@
+import re
+from time import perf_counter
+from asyncio import Semaphore, gather
+from logging import getLogger
+from airlatex.util import Stats
+
+
+# characters with a meaning in regular expressions (patterns without them are literal)
+_special = set(".^$*+?{}[]\\|()")
+
+
+def _trigrams(text):
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+class ProjectSearch:
+
+    def __init__(self, handler, concurrency=4, indexed=False):
+        """
+        Searches all documents of a project:
+        - opened documents are searched in their saved buffer
+        - all other documents are fetched (at most concurrency at once) through the Prefetcher, such
+          that opening a document waits for its fetch
+        - if indexed, fetched documents stay joined without buffer (see RemoteDocuments) & a trigram
+          index of their (lowercase) text is kept, such that literal queries only scan documents
+          containing all of their trigrams
+        - the index of a document is recomputed at the next search after it changed (otUpdateApplied)
+        """
+        self.handler = handler
+        self.semaphore = Semaphore(concurrency)
+        self.indexed = indexed
+        self.trigrams = {}
+        self.postings = {}
+        self.dirty = set()
+        self.stats = Stats()
+        self.log = getLogger("AirLatex")
+        if indexed:
+            handler.remote.listeners.append(self.dirty.add)
+
+
+    # ------- #
+    # helpers #
+    # ------- #
+
+    def _reindex(self, doc_id, text):
+        for trigram in self.trigrams.pop(doc_id, ()):
+            self.postings[trigram].discard(doc_id)
+        if text is None:
+            return
+        trigrams = self.trigrams[doc_id] = _trigrams(text.lower())
+        for trigram in trigrams:
+            self.postings.setdefault(trigram, set()).add(doc_id)
+
+    # documents that may contain the literal query (None if all need to be scanned)
+    def _candidates(self, query):
+        if len(query) < 3:
+            return None
+        candidates = None
+        for trigram in _trigrams(query.lower()):
+            docs = self.postings.get(trigram, set())
+            candidates = set(docs) if candidates is None else candidates & docs
+            if not candidates:
+                break
+        return candidates
+
+    # opened => saved buffer is up to date
+    def _bufferText(self, doc_id):
+        saved_buffer = self.handler.documents[doc_id]["buffer"].saved_buffer
+        return "\n".join(saved_buffer[:]) if saved_buffer is not None else None
+
+    async def _text(self, doc_id):
+        handler = self.handler
+        if doc_id in handler.documents:
+            return self._bufferText(doc_id)
+
+        # joined without buffer (waits if it is being joined)
+        if self.indexed or handler.remote.tracks(doc_id):
+            text = handler.remote.text(doc_id)
+            if text is None:
+                text = await handler.remote.join(doc_id, self.semaphore)
+            if self.indexed and doc_id not in self.trigrams:
+                self._reindex(doc_id, text)
+            return text
+
+        async with self.semaphore:
+            if doc_id in handler.documents:
+                return self._bufferText(doc_id)
+            with self.stats.timer("fetch"):
+                document = await handler.prefetcher.fetch(doc_id)
+        return "\n".join(document["lines"])
+
+
+    # --- #
+    # api # (to be used by AirLatexSession)
+    # --- #
+
+    async def grep(self, pattern):
+        """
+        Matches of the (python) regular expression in all documents as quickfix entries.
+        (case-insensitive if the pattern is lowercase)
+        """
+        start = perf_counter()
+        regex = re.compile(pattern, 0 if pattern != pattern.lower() else re.IGNORECASE)
+        docs = self.handler.index.documents()
+
+        # literal queries only need to scan the candidates of the index (& opened/unindexed documents)
+        candidates = None
+        if self.indexed:
+            for doc_id in list(self.dirty):
+                self._reindex(doc_id, self.handler.remote.text(doc_id))
+            self.dirty.clear()
+            if not any(c in _special for c in pattern):
+                candidates = self._candidates(pattern)
+        if candidates is not None:
+            docs = [doc for doc in docs if doc["_id"] in candidates or doc["_id"] in self.handler.documents or doc["_id"] not in self.trigrams]
+
+        texts = await gather(*[self._text(doc["_id"]) for doc in docs], return_exceptions=True)
+        results = []
+        failed = 0
+        for doc, text in zip(docs, texts):
+            if isinstance(text, Exception):
+                self.log.info("Grep: could not fetch %s: %s", doc["name"], repr(text))
+                failed += 1
+                continue
+            if text is None:
+                continue
+            filename = "/".join([self.handler.project["name"]] + [e["name"] for e in self.handler.index.chain(doc["_id"])])
+            for lnum, line in enumerate(text.split("\n")):
+                match = regex.search(line)
+                if match:
+                    results.append({"filename": filename, "lnum": lnum+1, "col": len(line[:match.start()].encode("utf8"))+1, "text": line})
+
+        duration = perf_counter() - start
+        self.stats.add("grep", duration * 1000, "ms")
+        self.stats.add("scanned documents", len(docs))
+        return results, "%i match(es) in %i of %i document(s) (%.2fs%s)" % (len(results), len({r["filename"] for r in results}), len(docs), duration, ", %i failed" % failed if failed else "")
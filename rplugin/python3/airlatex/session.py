@@ -6,12 +6,19 @@ import json
 import time
 import tempfile
 from threading import Thread, currentThread
-from asyncio import Lock, sleep, create_task
+from asyncio import Lock, sleep, create_task, gather
 from queue import Queue
-from os.path import expanduser
+from os import environ
+from os.path import expanduser, join
 import re
-from airlatex.project_handler import AirLatexProject
-from airlatex.util import _genTimeStamp
+from airlatex.connection import ConnectionManager
+from airlatex.cache import SnapshotCache
+from airlatex.files import FileCache
+from airlatex.mirror import ProjectMirror
+from airlatex.compiler import ProjectCompiler
+from airlatex.search import ProjectSearch
+from airlatex.httpclient import AsyncHTTP
+from airlatex.util import _genTimeStamp, Stats
 from http.cookiejar import CookieJar
 from logging import getLogger
 
@@ -24,7 +31,7 @@ class AirLatexSession:
         Manages the Session to the server:
         - tries to login with credentials & checks wether these suffice as authentication
         - queries the project list
-        - initializes AirLatexProject objects
+        - initializes AirLatexProject objects (through the ConnectionManager)
         """
 
         self.sidebar = sidebar
@@ -35,8 +42,29 @@ class AirLatexSession:
         self.url = ("https://" if https else "http://") + domain
         self.authenticated = False
         self.httpHandler = requests.Session()
+        self.http = AsyncHTTP(self.httpHandler.cookies)
+        self.stats = Stats()
         self.projectList = []
         self.log = getLogger("AirLatex")
+        compression_level = self.nvim.eval("g:AirLatexCompression")
+        compression = {"compression_level": compression_level, "mem_level": self.nvim.eval("g:AirLatexCompressionMemLevel")} if compression_level else None
+        prefetch = {
+            "limit": self.nvim.eval("g:AirLatexPrefetch"),
+            "max_size": self.nvim.eval("g:AirLatexPrefetchMaxSize"),
+            "concurrency": self.nvim.eval("g:AirLatexPrefetchConcurrency"),
+        }
+        cache_dir = join(self.nvim.eval("g:AirLatexCacheDir") or join(environ.get("XDG_CACHE_HOME", "~/.cache"), "AirLatex"), domain)
+        snapshots = None
+        if self.nvim.eval("g:AirLatexCache"):
+            snapshots = SnapshotCache(join(cache_dir, "documents"), max_size=self.nvim.eval("g:AirLatexCacheMaxSize"), max_age=self.nvim.eval("g:AirLatexCacheMaxAge"), legacy_directory=cache_dir)
+        self.files = FileCache(self, join(cache_dir, "files"), concurrency=self.nvim.eval("g:AirLatexDownloadConcurrency"))
+        self.compiler = ProjectCompiler(self, join(cache_dir, "output"), outputs=self.nvim.eval("g:AirLatexCompileOutputs"))
+        self.grep = {
+            "concurrency": self.nvim.eval("g:AirLatexGrepConcurrency"),
+            "indexed": self.nvim.eval("g:AirLatexGrepIndex"),
+        }
+        self.csrf = None
+        self.connections = ConnectionManager(self, reconnect_max_delay=self.nvim.eval("g:AirLatexReconnectMaxDelay"), compression=compression, prefetch=prefetch, snapshots=snapshots)
 
         self.wait_for = self.nvim.eval("g:AirLatexWebsocketTimeout")
         self.username = self.nvim.eval("g:AirLatexUsername")
@@ -57,24 +85,6 @@ class AirLatexSession:
             await sleep(0.1)
             i += 1
 
-    async def _getWebSocketURL(self):
-        """
-        Query websites websocket meta information to be used for further connections.
-        """
-        if self.authenticated:
-            # Generating timestamp
-            timestamp = _genTimeStamp()
-
-            # To establish a websocket connection
-            # the client must query for a sec url
-            self.httpHandler.get(self.url + "/project")
-            channelInfo = self.httpHandler.get(self.url + "/socket.io/1/?t="+timestamp)
-            self.log.debug("Websocket channelInfo '%s'"%channelInfo.text)
-            wsChannel = channelInfo.text[0:channelInfo.text.find(":")]
-            self.log.debug("Websocket wsChannel '%s'"%wsChannel)
-            return ("wss://" if self.https else "ws://") + self.domain + "/socket.io/1/websocket/"+wsChannel
-
-
     # --- #
     # api # (to be used by pynvim.plugin)
     # --- #
@@ -84,9 +94,9 @@ class AirLatexSession:
         Disconnects all connected AirLatexProjects.
         """
         self.log.debug("cleanup()")
+        await self.connections.closeAll(msg)
+        self.http.close()
         for p in self.projectList:
-            if "handler" in p:
-                p["handler"].disconnect()
             p["connected"] = False
         create_task(self.sidebar.updateStatus(msg))
 
@@ -95,29 +105,37 @@ class AirLatexSession:
         Test authentication by opening webpage & retrieving project list.
         """
         self.log.debug("login()")
+        start = time.perf_counter()
+
+        # drop outdated snapshots in the background
+        if self.connections.snapshots is not None:
+            self.nvim.loop.run_in_executor(None, self.connections.snapshots.evict)
+
         if not self.authenticated:
 
             if not self.username.startswith("cookies:"):
 
                 anim_status = create_task(self._makeStatusAnimation("Login"))
 
-                # get csrf token
-                loginpage_request = lambda: self.httpHandler.get(self.url + "/login")
-                loginpage = await self.nvim.loop.run_in_executor(None, loginpage_request)
-                if loginpage.ok:
-                    csrf_input = re.search('<input\s[^>]*name="_csrf"[^>]*>', loginpage.text)
-                    csrf = re.search('value="([^"]*)"',csrf_input[0])[1] if csrf_input else None
-
                 # try to login
                 try:
+
+                    # get csrf token (while the keyring is queried)
+                    password = self.nvim.loop.run_in_executor(None, keyring.get_password, "airlatex_"+self.domain, self.username)
+                    loginpage, password = await gather(self.http.get(self.url + "/login"), password)
+                    csrf = None
+                    if loginpage.ok:
+                        csrf_input = re.search('<input\s[^>]*name="_csrf"[^>]*>', loginpage.text)
+                        csrf = re.search('value="([^"]*)"',csrf_input[0])[1] if csrf_input else None
+                        self.csrf = csrf
+
                     data = {
                         "email": self.username,
-                        "password": keyring.get_password("airlatex_"+self.domain, self.username)
+                        "password": password
                     }
                     if csrf is not None:
                         data["_csrf"] = csrf
-                    login = lambda: self.httpHandler.post(self.url + "/login", data=data)
-                    login_response = await self.nvim.loop.run_in_executor(None, login)
+                    login_response = await self.http.post(self.url + "/login", data=data)
                     anim_status.cancel()
                     if not login_response.ok:
                         with tempfile.NamedTemporaryFile(delete=False) as f:
@@ -135,22 +153,24 @@ class AirLatexSession:
                     if "=" not in c:
                         raise ValueError("Cookie has no value. Found: %s" % c)
                     name, value = c.split("=", 1)
-                    self.log.debug("Found Cookie for domain '%s' named '%s'" % (name, value))
+                    self.log.debug("Found Cookie for domain '%s' named '%s'", name, value)
                     self.httpHandler.cookies[name] = value
 
             anim_status = create_task(self._makeStatusAnimation("Connecting"))
             # check if cookie found by testing if projects redirects to login page
             try:
-                get = lambda: self.httpHandler.get(self.url + "/project", allow_redirects=False)
-                redirect = await self.nvim.loop.run_in_executor(None, get)
+                redirect = await self.http.get(self.url + "/project", follow_redirects=False)
                 anim_status.cancel()
-                if redirect.ok:
+                if redirect.status_code == 200:
 
+                    # the project page lists the projects already
                     self.authenticated = True
-                    await self.updateProjectList()
+                    if await self.updateProjectList(redirect):
+                        self.stats.add("login to project list", (time.perf_counter() - start) * 1000, "ms")
+                        create_task(self.sidebar.updateStatus("Online (logged in & loaded %i projects in %.2fs)" % (len(self.projectList), time.perf_counter() - start)))
                     return True
                 else:
-                    self.log.debug("Could not fetch '%s/project'. Response chain: %s" % (self.url, str(redirect)))
+                    self.log.debug("Could not fetch '%s/project'. Response chain: %s", self.url, redirect)
                     with tempfile.NamedTemporaryFile(delete=False) as f:
                         f.write(redirect.text.encode())
                         create_task(self.sidebar.updateStatus("Connection failed: I could not retrieve the project list. You can check the response page under: %s" % f.name))
@@ -161,17 +181,19 @@ class AirLatexSession:
         else:
             return False
 
-    async def updateProjectList(self):
+    async def updateProjectList(self, projectPage=None):
         """
-        Retrieves project list.
+        Retrieves project list (from projectPage, if it has just been loaded).
+        Returns True on success.
         """
         self.log.debug("updateProjectList()")
         if self.authenticated:
-            anim_status = create_task(self._makeStatusAnimation("Loading Projects"))
-
-            get = lambda: self.httpHandler.get(self.url + "/project", allow_redirects=False)
-            projectPage = (await self.nvim.loop.run_in_executor(None, get))
-            anim_status.cancel()
+            if projectPage is None:
+                anim_status = create_task(self._makeStatusAnimation("Loading Projects"))
+                with self.stats.timer("project list"):
+                    projectPage = await self.http.get(self.url + "/project", follow_redirects=False)
+                anim_status.cancel()
+            self.connections.project_page_time = time.time()
 
             meta = re.search('<meta\s[^>]*name="ol-projects"[^>]*>', projectPage.text) if projectPage.ok else None
             if not projectPage.ok or meta is None:
@@ -181,20 +203,24 @@ class AirLatexSession:
                     create_task(self.sidebar.updateStatus("Offline. Please Login. I saved the webpage '%s' I got under %s." % (self.url, f.name)))
                     self.nvim.async_call(self.sidebar.vimCursorSet, 6, 1)
                     create_task(self.sidebar.triggerRefresh())
-                return []
+                return False
 
             try:
                 project_data_escaped = re.search('content="([^"]*)"',meta[0])[1]
                 data = html.unescape(project_data_escaped)
-                self.log.debug("project_data="+data)
+                self.log.debug("project_data=%s", data)
                 data = json.loads(data)
                 self.user_id = re.search('content="([^"]*)"',re.search('<meta\s[^>]*name="ol-user_id"[^>]*>', projectPage.text)[0])[1]
+                csrf_meta = re.search('<meta\s[^>]*name="ol-csrfToken"[^>]*>', projectPage.text)
+                if csrf_meta:
+                    self.csrf = re.search('content="([^"]*)"',csrf_meta[0])[1]
                 create_task(self.sidebar.updateStatus("Online"))
                 self.log.debug(data)
 
                 self.projectList = data
                 self.projectList.sort(key=lambda p: p["lastUpdated"], reverse=True)
                 create_task(self.sidebar.triggerRefresh())
+                return True
             except Exception as e:
 
                 with tempfile.NamedTemporaryFile(delete=False) as f:
@@ -212,10 +238,99 @@ class AirLatexSession:
         anim_status = create_task(self._makeStatusAnimation("Connecting to Project"))
 
         # start connection
-        anim_status.cancel()
-        cookie_str = "; ".join(name + "=" + value for name, value in self.httpHandler.cookies.get_dict().items())
-        airlatexproject = AirLatexProject(await self._getWebSocketURL(), project, self.user_id, self.sidebar, cookie=cookie_str, wait_for=self.wait_for)
-        create_task(airlatexproject.start())
+        try:
+            cookie_str = "; ".join(name + "=" + value for name, value in self.httpHandler.cookies.get_dict().items())
+            await self.connections.open(project, self.user_id, self.sidebar, cookie=cookie_str, wait_for=self.wait_for)
+        finally:
+            anim_status.cancel()
+
+    async def mirrorProject(self, handler, directory):
+        """
+        Keeps a local directory in sync with a connected project.
+        """
+        if handler.mirror is None or handler.mirror.directory != expanduser(directory):
+            if handler.mirror is not None:
+                handler.mirror.stop()
+            handler.mirror = ProjectMirror(handler, directory, self.files)
+        anim_status = create_task(self._makeStatusAnimation("Mirroring to %s" % directory))
+        try:
+            start = time.perf_counter()
+            await handler.mirror.start()
+        finally:
+            anim_status.cancel()
+        create_task(self.sidebar.updateStatus("Mirroring '%s' to %s (synced in %.2fs)" % (handler.project["name"], directory, time.perf_counter() - start)))
+
+    async def grepProject(self, handler, pattern):
+        """
+        Searches all documents of a connected project, results are put into the quickfix list.
+        """
+        if handler.search is None:
+            handler.search = ProjectSearch(handler, **self.grep)
+        anim_status = create_task(self._makeStatusAnimation("Searching '%s'" % handler.project["name"]))
+        try:
+            results, summary = await handler.search.grep(pattern)
+        except re.error as e:
+            create_task(self.sidebar.updateStatus("Invalid pattern '%s': %s" % (pattern, e)))
+            return
+        finally:
+            anim_status.cancel()
+
+        def setQuickfix():
+            self.nvim.funcs.setqflist([], " ", {"title": "AirLatexGrep %s" % pattern, "items": results})
+            if results:
+                self.nvim.command("copen")
+        self.nvim.async_call(setQuickfix)
+        create_task(self.sidebar.updateStatus("Grep '%s': %s" % (pattern, summary)))
+
+    async def compileProject(self, handler):
+        """
+        Compiles a connected project on the server & downloads the changed outputs.
+        """
+        if not self.authenticated:
+            create_task(self.sidebar.updateStatus("Not Authenticated to compile"))
+            return
+
+        anim_status = create_task(self._makeStatusAnimation("Compiling '%s'" % handler.project["name"]))
+        try:
+
+            # the server compiles what it knows => wait for the latest changes to be accepted
+            timeout = handler.wait_for or 15
+            if not await handler.synced(timeout):
+                create_task(self.sidebar.updateStatus("Compile skipped: the server did not accept the latest changes within %is" % timeout))
+                return
+            status, paths, summary = await self.compiler.compile(handler.project)
+        except Exception as e:
+            self.log.info("Compile failed: %s", repr(e))
+            create_task(self.sidebar.updateStatus("Compile failed: %s" % e))
+            return
+        finally:
+            anim_status.cancel()
+        pdf = [path for path in paths.values() if path.endswith(".pdf")]
+        create_task(self.sidebar.updateStatus("Compile %s (%s)%s" % (status, summary, ": " + pdf[0] if pdf else "")))
+
+    async def downloadFiles(self, project, files):
+        """
+        Downloads binary files (fileRefs) of a project into the local file cache.
+        """
+        if not self.authenticated:
+            create_task(self.sidebar.updateStatus("Not Authenticated to download"))
+            return
+
+        anim_status = create_task(self._makeStatusAnimation("Downloading %i file(s)" % len(files)))
+        try:
+            paths = await self.files.fetchAll(project["id"], files)
+        finally:
+            anim_status.cancel()
+
+        failed = [(file, e) for file, e in zip(files, paths) if isinstance(e, Exception)]
+        for file, e in failed:
+            self.log.info("Could not download '%s': %s", file["name"], e)
+        if failed:
+            create_task(self.sidebar.updateStatus("Could not download %i of %i file(s), e.g. '%s': %s" % (len(failed), len(files), failed[0][0]["name"], failed[0][1])))
+        elif len(files) == 1:
+            create_task(self.sidebar.updateStatus("Downloaded '%s' to %s" % (files[0]["name"], paths[0])))
+        else:
+            create_task(self.sidebar.updateStatus("Downloaded %i files to %s" % (len(files), join(self.files.directory, "blobs"))))
 
 
 
@@ -0,0 +1,204 @@
+from hashlib import sha1
+
+
+class Fenwick:
+
+    def __init__(self, values):
+        """
+        Fenwick tree over a list of non-negative integers.
+        - prefix sums, point updates & search are O(log n)
+        """
+        self.n = len(values)
+        self.tree = tree = [0] + list(values)
+        for i in range(1, self.n+1):
+            j = i + (i & -i)
+            if j <= self.n:
+                tree[j] += tree[i]
+        self.total = self.prefix(self.n)
+
+        # largest power of two not greater than n (for binary lifting)
+        self.mask = 1 << (self.n.bit_length()-1) if self.n else 0
+
+    def __len__(self):
+        return self.n
+
+    # sum of the first i values
+    def prefix(self, i):
+        tree = self.tree
+        s = 0
+        while i > 0:
+            s += tree[i]
+            i -= i & -i
+        return s
+
+    def add(self, i, delta):
+        tree = self.tree
+        self.total += delta
+        i += 1
+        while i <= self.n:
+            tree[i] += delta
+            i += i & -i
+
+    # largest i with prefix(i) <= value, and the remainder value-prefix(i)
+    def find(self, value):
+        tree = self.tree
+        i = 0
+        bit = self.mask
+        while bit:
+            j = i + bit
+            if j <= self.n and tree[j] <= value:
+                i = j
+                value -= tree[j]
+            bit >>= 1
+        return i, value
+
+
+class ShadowDocument:
+
+    def __init__(self, lines=[""], chunk_size=512):
+        """
+        Copy of the document as known by the server, changed in place by local & remote changes.
+        - lines are stored in chunks of at most 2*chunk_size lines (a flat rope)
+        - line & character counts of the chunks are indexed by Fenwick trees
+        - locating a line or character and changing lines is O(chunk_size + log n)
+        - utf-8 encoded lines are cached for the document hash
+        Supports len(), indexing & slice assignment like a list of lines (or a Neovim buffer).
+        """
+        self.chunk_size = chunk_size
+        lines = list(lines)
+        self._build([lines[i:i+chunk_size] for i in range(0, len(lines), chunk_size)] or [[]])
+
+    def _build(self, chunks):
+        self.chunks = chunks
+        self.encoded = [[l.encode() for l in chunk] for chunk in chunks]
+        self.char_sizes = [sum(len(l)+1 for l in chunk) for chunk in chunks]
+        self._reindex()
+
+    # rebuild the Fenwick trees from the stored per-chunk counts
+    def _reindex(self):
+        self.line_counts = Fenwick([len(chunk) for chunk in self.chunks])
+        self.char_counts = Fenwick(self.char_sizes)
+        self.content_hash = None
+
+    def __len__(self):
+        return self.line_counts.total
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from chunk
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(len(self))
+            if stop <= start:
+                return []
+            ci, a = self._locate(start)
+            result = []
+            while len(result) < stop - start:
+                result += self.chunks[ci][a:a+stop-start-len(result)]
+                ci, a = ci+1, 0
+            return result
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("line index out of range")
+        ci, a = self._locate(key)
+        return self.chunks[ci][a]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(len(self))
+            self.replace(start, max(start, stop), value)
+        else:
+            if key < 0:
+                key += len(self)
+            self.replace(key, key+1, [value])
+
+    # chunk & index within chunk of line
+    # (end of document is located behind the last line of the last chunk)
+    def _locate(self, line):
+        ci, a = self.line_counts.find(line)
+        if ci >= len(self.chunks):
+            ci = len(self.chunks)-1
+            a = len(self.chunks[ci])
+        return ci, a
+
+    # character offset of the first character in line
+    def offset(self, line):
+        ci, a = self._locate(line)
+        return self.char_counts.prefix(ci) + sum(len(l)+1 for l in self.chunks[ci][:a])
+
+    # line and column of character offset
+    # (the newline at the end of a line belongs to that line)
+    def find(self, pos):
+        ci, rest = self.char_counts.find(pos)
+        if ci >= len(self.chunks):
+            line = len(self) - 1
+            return line, pos - self.offset(line)
+        chunk = self.chunks[ci]
+        a = 0
+        while a < len(chunk)-1 and rest >= len(chunk[a])+1:
+            rest -= len(chunk[a])+1
+            a += 1
+        return self.line_counts.prefix(ci) + a, rest
+
+    # number of characters (as sent to the server)
+    def charCount(self):
+        return self.char_counts.total - 1
+
+    # replace lines [first, last) by lines
+    def replace(self, first, last, lines):
+        lines = list(lines)
+        ci, a = self._locate(first)
+        cj, b = self._locate(last)
+        if b == 0 and cj > ci:
+            cj -= 1
+            b = len(self.chunks[cj])
+
+        # change inside a single chunk
+        if ci == cj:
+            chunk = self.chunks[ci]
+            chars = sum(len(l)+1 for l in lines) - sum(len(l)+1 for l in chunk[a:b])
+            chunk[a:b] = lines
+            self.encoded[ci][a:b] = [l.encode() for l in lines]
+            if len(chunk) > 2*self.chunk_size or not chunk and len(self.chunks) > 1:
+                self._rechunk(ci, ci+1)
+            else:
+                self.char_sizes[ci] += chars
+                self.line_counts.add(ci, len(lines) - (b-a))
+                self.char_counts.add(ci, chars)
+                self.content_hash = None
+
+        # change spans multiple chunks
+        else:
+            self.chunks[ci:cj+1] = [self.chunks[ci][:a] + lines + self.chunks[cj][b:]]
+            self.encoded[ci:cj+1] = [self.encoded[ci][:a] + [l.encode() for l in lines] + self.encoded[cj][b:]]
+            self.char_sizes[ci:cj+1] = [0]
+            self._rechunk(ci, ci+1)
+
+    # split/drop chunks [ci, cj), only their character counts are recomputed
+    def _rechunk(self, ci, cj):
+        size = self.chunk_size
+        chunks, encoded, sizes = [], [], []
+        for chunk, enc in zip(self.chunks[ci:cj], self.encoded[ci:cj]):
+            for k in range(0, len(chunk), size):
+                chunks.append(chunk[k:k+size])
+                encoded.append(enc[k:k+size])
+                sizes.append(sum(len(l)+1 for l in chunks[-1]))
+        self.chunks[ci:cj] = chunks
+        self.encoded[ci:cj] = encoded
+        self.char_sizes[ci:cj] = sizes
+        if not self.chunks:
+            self.chunks, self.encoded, self.char_sizes = [[]], [[]], [0]
+        self._reindex()
+
+    # git-blob sha1-hash (as computed by overleaf)
+    def contentHash(self):
+        if self.content_hash is None:
+            sha = sha1(b"blob %i\x00" % self.charCount())
+            for k, enc in enumerate(self.encoded):
+                if k > 0:
+                    sha.update(b"\n")
+                sha.update(b"\n".join(enc))
+            self.content_hash = sha.hexdigest()
+        return self.content_hash
@@ -3,7 +3,7 @@ from time import gmtime, strftime
 from asyncio import Queue, Lock, sleep, create_task
 from airlatex.documentbuffer import DocumentBuffer
 from logging import getLogger, NOTSET
-from airlatex.util import __version__, pynvimCatchException
+from airlatex.util import __version__, pynvimCatchException, DEBUG_GUI
 
 
 
@@ -125,7 +125,7 @@ class SideBar:
         self._listProjects(overwrite)
 
     def _listProjects(self, overwrite=False):
-        self.log.debug_gui("listProjects(%s)" % str(overwrite))
+        self.log.debug_gui("listProjects(%s)", overwrite)
         if self.buffer == self.nvim.current.window.buffer:
             self.cursor = self.nvim.current.window.cursor
 
@@ -277,7 +277,8 @@ class SideBar:
     def cursorAction(self, key="enter"):
         if not isinstance(self.cursorPos, list):
             return
-        self.log.debug_gui("cursorAction(%s) on %s" % (key, ",".join(str(p) for p in self.cursorPos)))
+        if self.log.isEnabledFor(DEBUG_GUI):
+            self.log.debug_gui("cursorAction(%s) on %s", key, ",".join(str(p) for p in self.cursorPos))
 
         if len(self.cursorPos) == 0:
             pass
@@ -287,7 +288,7 @@ class SideBar:
             # disconnect all
             if self.cursorPos[0] == "disconnect":
                 if self.airlatex.session:
-                    self.airlatex.session.cleanup()
+                    create_task(self.airlatex.session.cleanup())
 
             # disconnect all
             elif self.cursorPos[0] == "retry":
@@ -302,11 +303,16 @@ class SideBar:
                         self._toggle(self.cursorPos[-1], "open", default=False)
                     elif key == "del":
                         if "connected" in project and project["connected"]:
-                            project["handler"].disconnect()
+                            create_task(project["handler"].disconnect())
                     create_task(self.triggerRefresh())
                 else:
                     create_task(self.airlatex.session.connectProject(project))
 
+        # download all files of a folder
+        elif self.cursorPos[-1] == "fileRefs":
+            folder = self.cursorPos[-2] if len(self.cursorPos) > 2 else self.cursorPos[0]["rootFolder"][0]
+            create_task(self.airlatex.session.downloadFiles(self.cursorPos[0], folder["fileRefs"]))
+
         elif not isinstance(self.cursorPos[-1], dict):
             pass
 
@@ -320,6 +326,10 @@ class SideBar:
             documentbuffer = DocumentBuffer(self.cursorPos, self.nvim)
             create_task(self.cursorPos[0]["handler"].joinDocument(documentbuffer))
 
+        # is binary file
+        elif self.cursorPos[-1]["type"] == "fileRef":
+            create_task(self.airlatex.session.downloadFiles(self.cursorPos[0], [self.cursorPos[-1]]))
+
 
 
 
@@ -0,0 +1,158 @@
+from logging import getLogger
+
+
+# score of query as (case-insensitive) subsequence of path or None
+# (consecutive characters & matches in the file name count more, shorter paths win ties)
+def fuzzyScore(query, path, path_lower=None):
+    path_lower = path_lower if path_lower is not None else path.lower()
+    name_start = path_lower.rfind("/") + 1
+    score = 0
+    pos = last = -1
+    run = 0
+    for c in query.lower():
+        pos = path_lower.find(c, pos+1)
+        if pos < 0:
+            return None
+        run = run + 1 if pos == last + 1 else 1
+        score += run + (2 if pos >= name_start else 0) + (3 if pos == name_start else 0)
+        last = pos
+    return score - len(path) / 1000
+
+
+class ProjectIndex:
+
+    def __init__(self):
+        """
+        Flat index of a project tree (the rootFolder of joinProject):
+        - maps id => entity & path => entity, with the parent folder of every entity
+        - entities are the dicts of the project tree (the sidebar shares them)
+        - kept up to date by the tree events of the server (see AirLatexProject.run)
+        """
+        self.entries = {}
+        self.paths = {}
+        self.log = getLogger("AirLatex")
+
+
+    # ------- #
+    # helpers #
+    # ------- #
+
+    def _add(self, entity, type, parent, path):
+        entity["type"] = type
+        self.entries[entity["_id"]] = {"entity": entity, "parent": parent, "path": path, "lower": path.lower()}
+        self.paths[path] = entity
+        if type == "folder":
+            for doc in entity["docs"]:
+                self._add(doc, "file", entity, path + "/" + doc["name"])
+            for file in entity["fileRefs"]:
+                self._add(file, "fileRef", entity, path + "/" + file["name"])
+            for folder in entity["folders"]:
+                self._add(folder, "folder", entity, path + "/" + folder["name"])
+
+    def _remove(self, entity):
+        entry = self.entries.pop(entity["_id"], None)
+        if entry is None:
+            return
+        self.paths.pop(entry["path"], None)
+        if entity["type"] == "folder":
+            for child in entity["docs"] + entity["fileRefs"] + entity["folders"]:
+                self._remove(child)
+
+    @staticmethod
+    def _children(folder, type):
+        return folder["folders"] if type == "folder" else folder["docs"] if type == "file" else folder["fileRefs"]
+
+    def _path(self, parent, name):
+        if parent is None:
+            return ""
+        return self.entries[parent["_id"]]["path"] + "/" + name
+
+
+    # --- #
+    # api # (to be used by AirLatexProject & commands)
+    # --- #
+
+    def build(self, root_folder):
+        self.entries = {}
+        self.paths = {}
+        self._add(root_folder, "folder", None, "")
+
+    def get(self, entity_id):
+        entry = self.entries.get(entity_id)
+        return entry["entity"] if entry else None
+
+    def byPath(self, path):
+        path = path.strip("/")
+        return self.paths.get("/" + path if path else "")
+
+    def path(self, entity_id):
+        """
+        Path of an entity relative to the project root (without leading slash).
+        """
+        return self.entries[entity_id]["path"][1:]
+
+    def chain(self, entity_id):
+        """
+        Folders from the root down to the entity, followed by the entity itself
+        (excluding the root folder, as the sidebar, e.g. for DocumentBuffer & quickfix file names).
+        """
+        chain = []
+        entry = self.entries[entity_id]
+        while entry["parent"] is not None:
+            chain.append(entry["entity"])
+            entry = self.entries[entry["parent"]["_id"]]
+        return list(reversed(chain))
+
+    def documents(self, type="file"):
+        return [entry["entity"] for entry in self.entries.values() if entry["entity"]["type"] == type]
+
+    def find(self, query, type="file", limit=20):
+        """
+        Paths of the entities matching query best (fuzzy, best first).
+        """
+        matches = []
+        for entry in self.entries.values():
+            if entry["entity"]["type"] != type:
+                continue
+            score = fuzzyScore(query, entry["path"][1:], entry["lower"][1:])
+            if score is not None:
+                matches.append((-score, entry["path"][1:]))
+        matches.sort()
+        return [path for _, path in matches[:limit]]
+
+    # tree events
+    def addEntity(self, folder_id, entity, type):
+        parent = self.get(folder_id)
+        if parent is None:
+            return False
+        self._children(parent, type).append(entity)
+        self._add(entity, type, parent, self._path(parent, entity["name"]))
+        return True
+
+    def removeEntity(self, entity_id):
+        entry = self.entries.get(entity_id)
+        if entry is None or entry["parent"] is None:
+            return False
+        entity = entry["entity"]
+        siblings = self._children(entry["parent"], entity["type"])
+        siblings[:] = [e for e in siblings if e is not entity]
+        self._remove(entity)
+        return True
+
+    def renameEntity(self, entity_id, name):
+        entry = self.entries.get(entity_id)
+        if entry is None or entry["parent"] is None:
+            return False
+        entity, parent = entry["entity"], entry["parent"]
+        self._remove(entity)
+        entity["name"] = name
+        self._add(entity, entity["type"], parent, self._path(parent, name))
+        return True
+
+    def moveEntity(self, entity_id, folder_id):
+        entry = self.entries.get(entity_id)
+        if entry is None or self.get(folder_id) is None:
+            return False
+        entity = entry["entity"]
+        self.removeEntity(entity_id)
+        return self.addEntity(folder_id, entity, entity["type"])
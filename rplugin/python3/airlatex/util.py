@@ -1,7 +1,12 @@
+import os
 import time
+import atexit
 import logging
 import traceback
+from queue import SimpleQueue
 from logging import NOTSET
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from contextlib import contextmanager
 
 
 __version__ = "0.2"
@@ -16,12 +21,49 @@ def _genTimeStamp():
         t += "0"
     return t
 
+# collect measurements to be shown by :AirLatexStats
+class Stats:
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, name, value, unit=""):
+        if name not in self.entries:
+            self.entries[name] = {"count": 0, "total": 0, "max": 0, "unit": unit}
+        entry = self.entries[name]
+        entry["count"] += 1
+        entry["total"] += value
+        entry["max"] = max(entry["max"], value)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000, "ms")
+
+    def format(self, indent=""):
+        lines = []
+        for name, e in sorted(self.entries.items()):
+            lines.append("%s%s: %i times, avg %.2f%s, max %.2f%s, total %.2f%s" % (indent, name, e["count"], e["total"] / e["count"], e["unit"], e["max"], e["unit"], e["total"], e["unit"]))
+        return lines
+
 # get logging
 logging_settings={
     "level": "NOTSET",
     "file": "AirLatex.log",
+    "max_size": 10,
+    "backups": 3,
     "gui": True
 }
+DEBUG_GUI = 9
+
+# writes the log file in a background thread
+log_listener = None
+def _stopLogListener():
+    if log_listener is not None:
+        log_listener.stop()
+atexit.register(_stopLogListener)
 
 class CustomLogRecord(logging.LogRecord):
     def __init__(self, *args, **kwargs):
@@ -30,6 +72,7 @@ class CustomLogRecord(logging.LogRecord):
         self.origin = f"{self.filename} / {self.funcName} #{self.lineno:<4}"
 
 def init_logger():
+    global log_listener
     log = logging.getLogger("AirLatex")
 
     # user settings
@@ -37,13 +80,12 @@ def init_logger():
     file=logging_settings["file"]
 
     # gui related logging
-    DEBUG_LEVEL_GUI = 9
-    logging.addLevelName(DEBUG_LEVEL_GUI, "DEBUG_GUI")
+    logging.addLevelName(DEBUG_GUI, "DEBUG_GUI")
     def debug_gui(self, message, *args, **kws):
-        if self.isEnabledFor(DEBUG_LEVEL_GUI) and logging_settings["gui"]:
-            self._log(DEBUG_LEVEL_GUI, message, args, **kws)
+        if self.isEnabledFor(DEBUG_GUI) and logging_settings["gui"]:
+            self._log(DEBUG_GUI, message, args, **kws)
     logging.Logger.debug_gui = debug_gui
-    logging.DEBUG_GUI = DEBUG_LEVEL_GUI
+    logging.DEBUG_GUI = DEBUG_GUI
 
     if level != "NOTSET":
 
@@ -51,12 +93,34 @@ def init_logger():
         logging.setLogRecordFactory(CustomLogRecord)
         f = logging.Formatter('%(origin)40s: %(message)s')
 
-        # handler
-        h = logging.FileHandler(file, "w")
+        # previous logger of this session
+        if log_listener is not None:
+            log_listener.stop()
+            for handler in log_listener.handlers:
+                handler.close()
+            log_listener = None
+        for handler in list(log.handlers):
+            if isinstance(handler, QueueHandler):
+                log.removeHandler(handler)
+
+        # handler (log of the previous session is kept as first backup)
+        max_size = int(logging_settings["max_size"] * 1024 * 1024)
+        backups = max(1, int(logging_settings["backups"]))
+        if max_size > 0:
+            h = RotatingFileHandler(file, maxBytes=max_size, backupCount=backups, delay=True)
+            if os.path.isfile(file) and os.path.getsize(file) > 0:
+                h.doRollover()
+        else:
+            h = logging.FileHandler(file, "w", delay=True)
         h.setFormatter(f)
 
+        # the event loop only enqueues records, the file is written by a background thread
+        queue = SimpleQueue()
+        log_listener = QueueListener(queue, h)
+        log_listener.start()
+
         # logger settings
-        log.addHandler(h)
+        log.addHandler(QueueHandler(queue))
         log.setLevel(getattr(logging,level))
 
     return log
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the airlatex package lives next to this directory (rplugin/python3)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,96 @@
+import os
+import json
+import asyncio
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from airlatex.compiler import ProjectCompiler
+
+
+# local stand-in for the compile & output endpoints of the server
+class CompileServer(BaseHTTPRequestHandler):
+    builds = {}
+    received = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.received.append(("POST", self.path, self.headers.get("X-Csrf-Token"), body))
+        project_id = self.path.split("/")[2]
+        outputs = [{"path": path, "url": "/project/%s/build/%s/output/%s" % (project_id, build, path), "build": build} for path, build in self.builds.items()]
+        self._send(json.dumps({"status": "success", "outputFiles": outputs, "clsiServerId": "clsi-1"}).encode())
+
+    def do_GET(self):
+        self.received.append(("GET", self.path, None, None))
+        parts = self.path.split("?")[0].split("/")
+        self._send(("%s of build %s" % (parts[-1], parts[-3])).encode())
+
+    def _send(self, data):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+@pytest.fixture
+def server():
+    CompileServer.builds = {"output.pdf": "b1", "output.log": "b1", "output.aux": "b1"}
+    CompileServer.received = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), CompileServer)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%i" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+def downloads():
+    return sorted(path.split("?")[0].split("/")[-1] for method, path, _, _ in CompileServer.received if method == "GET")
+
+
+def test_compile_downloads_changed_outputs(server, tmp_path):
+    session = SimpleNamespace(url=server, csrf="token", httpHandler=requests.Session())
+    compiler = ProjectCompiler(session, str(tmp_path), outputs=("output.pdf", "output.log"))
+    project = {"id": "p1", "rootDoc_id": "d1"}
+
+    # first compile => all wanted outputs
+    status, paths, summary = asyncio.run(compiler.compile(project))
+    assert status == "success"
+    assert downloads() == ["output.log", "output.pdf"]
+    assert sorted(paths) == ["output.log", "output.pdf"]
+    with open(paths["output.pdf"]) as f:
+        assert f.read() == "output.pdf of build b1"
+    method, path, csrf, body = CompileServer.received[0]
+    assert (method, path, csrf, body["rootDoc_id"]) == ("POST", "/project/p1/compile", "token", "d1")
+    assert all("clsiserverid=clsi-1" in path for method, path, _, _ in CompileServer.received if method == "GET")
+
+    # unchanged builds => nothing downloaded
+    CompileServer.received = []
+    status, paths, summary = asyncio.run(compiler.compile(project))
+    assert downloads() == []
+    assert sorted(paths) == ["output.log", "output.pdf"]
+    assert compiler.stats.entries["outputs unchanged"]["count"] == 2
+    assert "downloaded 0 of 2" in summary
+
+    # changed pdf => only the pdf
+    CompileServer.received = []
+    CompileServer.builds["output.pdf"] = "b2"
+    status, paths, summary = asyncio.run(compiler.compile(project))
+    assert downloads() == ["output.pdf"]
+    with open(paths["output.pdf"]) as f:
+        assert f.read() == "output.pdf of build b2"
+    with open(os.path.join(str(tmp_path), "p1", "builds.json")) as f:
+        assert json.load(f) == {"output.pdf": "b2", "output.log": "b1"}
+
+def test_compile_redownloads_missing_outputs(server, tmp_path):
+    session = SimpleNamespace(url=server, csrf=None, httpHandler=requests.Session())
+    compiler = ProjectCompiler(session, str(tmp_path), outputs=("output.pdf",))
+    project = {"id": "p1"}
+    _, paths, _ = asyncio.run(compiler.compile(project))
+    os.remove(paths["output.pdf"])
+    CompileServer.received = []
+    asyncio.run(compiler.compile(project))
+    assert downloads() == ["output.pdf"]
+    assert CompileServer.received[0][2] is None
@@ -0,0 +1,141 @@
+import random
+from airlatex.ot import compose, transformX, OTClient
+
+
+def apply(text, ops):
+    for op in ops:
+        if "i" in op:
+            assert 0 <= op["p"] <= len(text)
+            text = text[:op["p"]] + op["i"] + text[op["p"]:]
+        else:
+            assert text[op["p"]:op["p"]+len(op["d"])] == op["d"]
+            text = text[:op["p"]] + text[op["p"]+len(op["d"]):]
+    return text
+
+# random op (list of components) that applies to text
+def randomOp(rng, text, size):
+    ops = []
+    for _ in range(size):
+        p = rng.randint(0, len(text))
+        if text and rng.random() < 0.5:
+            p = min(p, len(text)-1)
+            op = {"p": p, "d": text[p:p+rng.randint(1, 4)]}
+        else:
+            op = {"p": p, "i": "".join(rng.choice("xyz\n") for _ in range(rng.randint(1, 3)))}
+        ops.append(op)
+        text = apply(text, [op])
+    return ops
+
+
+def test_compose_random():
+    rng = random.Random(8)
+    for _ in range(2000):
+        text = "".join(rng.choice("abc\n") for _ in range(rng.randint(0, 12)))
+        ops = randomOp(rng, text, rng.randint(0, 8))
+        composed = compose(ops)
+        assert apply(text, composed) == apply(text, ops)
+        assert compose(composed) == composed
+
+        # components are ordered by position & never empty
+        positions = [op["p"] for op in composed]
+        assert positions == sorted(positions)
+        assert all(op.get("i") or op.get("d") for op in composed)
+
+def test_compose_merges_typing():
+    ops = [{"p": 3 + k, "i": c} for k, c in enumerate("hello")]
+    assert compose(ops) == [{"p": 3, "i": "hello"}]
+
+def test_compose_merges_backspace():
+    ops = [{"p": 5 - k, "d": c} for k, c in enumerate("olleh")]
+    assert compose(ops) == [{"p": 1, "d": "hello"}]
+
+def test_compose_drops_undone_changes():
+    assert compose([{"p": 2, "i": "abc"}, {"p": 2, "d": "abc"}]) == []
+    assert compose([{"p": 2, "d": "abc"}, {"p": 2, "i": "abc"}]) == []
+    assert compose([{"p": 0, "i": "ab"}, {"p": 1, "d": "b"}]) == [{"p": 0, "i": "a"}]
+
+
+def test_transformX_converges():
+    rng = random.Random(9)
+    for _ in range(3000):
+        text = "".join(rng.choice("abc\n") for _ in range(rng.randint(0, 12)))
+        left = randomOp(rng, text, rng.randint(0, 4))
+        right = randomOp(rng, text, rng.randint(0, 4))
+        left_, right_ = transformX(left, right)
+        assert apply(apply(text, left), right_) == apply(apply(text, right), left_)
+
+def test_transformX_insert_order():
+    left, right = [{"p": 1, "i": "L"}], [{"p": 1, "i": "R"}]
+    left_, right_ = transformX(left, right)
+    assert apply(apply("ab", left), right_) == "aLRb"
+    assert apply(apply("ab", right), left_) == "aLRb"
+
+def test_transformX_overlapping_deletes():
+    left_, right_ = transformX([{"p": 1, "d": "bcd"}], [{"p": 2, "d": "cde"}])
+    assert left_ == [{"p": 1, "d": "b"}]
+    assert right_ == [{"p": 1, "d": "e"}]
+
+# client & server receiving concurrent remote changes reach the same document
+def test_client_converges_with_server():
+    rng = random.Random(10)
+    for _ in range(300):
+        server = local = "".join(rng.choice("abc\n") for _ in range(rng.randint(0, 12)))
+        sent = []
+        client = OTClient(sent.append)
+        for _ in range(30):
+            event = rng.random()
+            if event < 0.35:
+                op = randomOp(rng, local, rng.randint(1, 3))
+                local = apply(local, op)
+                client.submit(op)
+            elif event < 0.5:
+                client.flush()
+            elif event < 0.8:
+                op = randomOp(rng, server, rng.randint(1, 3))
+                server = apply(server, op)
+                local = apply(local, client.receive(op))
+            elif client.inflight is not None:
+                # the server transforms the op against the changes the client had not seen yet,
+                # the same as the client did when receiving them
+                server = apply(server, client.inflight)
+                client.ack()
+
+        while client.state != "synchronized" or client.pending:
+            if client.inflight is not None:
+                server = apply(server, client.inflight)
+                client.ack()
+            else:
+                client.flush()
+        assert server == local
+
+def test_client_states():
+    sent = []
+    client = OTClient(sent.append)
+    assert client.state == "synchronized"
+    client.submit([{"p": 0, "i": "a"}])
+    client.flush()
+    assert client.state == "awaiting ack" and sent == [[{"p": 0, "i": "a"}]]
+    client.submit([{"p": 1, "i": "b"}])
+    client.flush()
+    assert client.state == "awaiting ack with buffer" and len(sent) == 1
+    client.resend()
+    assert sent[-1] == [{"p": 0, "i": "a"}]
+    client.ack()
+    assert client.state == "awaiting ack" and sent[-1] == [{"p": 1, "i": "b"}]
+    client.ack()
+    assert client.state == "synchronized" and not client.pending
+
+def test_client_ack_without_flush():
+    sent = []
+    client = OTClient(sent.append)
+    client.submit([{"p": 0, "i": "a"}])
+    client.flush()
+    client.submit([{"p": 1, "i": "b"}])
+    client.flush()
+
+    # replaying missed updates: pending changes wait until all of them are transformed
+    client.ack(flush=False)
+    assert len(sent) == 1 and client.pending == [{"p": 1, "i": "b"}]
+    assert client.receive([{"p": 0, "i": "xy"}]) == [{"p": 0, "i": "xy"}]
+    client.flush()
+    assert sent[-1] == [{"p": 3, "i": "b"}]
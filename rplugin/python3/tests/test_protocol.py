@@ -0,0 +1,136 @@
+import gc
+import re
+import json
+import random
+import asyncio
+import pytest
+from airlatex import protocol
+from airlatex.protocol import parseFrame
+
+
+# message loop before parseFrame
+codere = re.compile(r"(\d):(?:(\d+)(\+?))?:(?::(?:(\d+)(\+?))?(.*))?")
+
+
+@pytest.mark.parametrize("msg, expected", [
+    ("1::", ("1", None, None, None)),
+    ("2::", ("2", None, None, None)),
+    ("0::", ("0", None, None, None)),
+    ("8::", ("8", None, None, None)),
+    ("5", ("5", None, None, None)),
+    ("", ("", None, None, None)),
+    ("5:12::", ("5", "12", None, None)),
+    ("5:3+::{\"a\":1}", ("5", "3", None, "{\"a\":1}")),
+    ("5:::{\"name\":\"x\",\"args\":[\"a:b::c\"]}", ("5", None, None, "{\"name\":\"x\",\"args\":[\"a:b::c\"]}")),
+    ("3:::hello:world", ("3", None, None, "hello:world")),
+    ("6:::7+[null,\"a+b\"]", ("6", None, "7", "[null,\"a+b\"]")),
+    ("6:::7", ("6", None, "7", None)),
+    ("6:::", ("6", None, None, None)),
+    ("7:::1+0", ("7", None, None, "1+0")),
+])
+def test_parseFrame(msg, expected):
+    assert parseFrame(msg) == expected
+
+def test_parseFrame_as_regex():
+    rng = random.Random(11)
+    payloads = ["", "[null]", "{\"a\":\"b:c+d\"}", "[null,[\"x::y\"],3]"]
+    for _ in range(500):
+        code = rng.choice("0125678")
+        msg_id = rng.choice(["", "4", "12+"])
+        data = rng.choice(payloads)
+        if code == "6":
+            data = str(rng.randint(1, 99)) + "+" + data if data else ""
+        msg = "%s:%s::%s" % (code, msg_id, data)
+
+        c, await_id, _, answer_id, _, rest = codere.match(msg).groups()
+        parsed = parseFrame(msg)
+        assert parsed[0] == c
+        assert parsed[1] == await_id
+        assert parsed[2] == answer_id
+        assert parsed[3] == (rest or None)
+
+@pytest.mark.parametrize("backend", ["json", "auto"])
+def test_json_backend(backend):
+    try:
+        protocol.setJSONBackend(backend)
+        message = {"name": "joinDoc", "args": ["id", 3, {"encodeRanges": True}], "text": "ä\\n"}
+        assert json.loads(protocol.dumps(message)) == message
+        assert protocol.loads(json.dumps(message)) == message
+    finally:
+        protocol.setJSONBackend("json")
+
+def test_json_backend_unknown():
+    with pytest.raises(ValueError):
+        protocol.setJSONBackend("yaml")
+
+
+def test_requests_resolve():
+    async def run():
+        table = protocol.RequestTable()
+        msg_id, future = table.add({"name": "joinDoc"}, timeout=5)
+        assert len(table) == 1
+        assert table.resolve(msg_id, [None, ["line"], 3]) == {"name": "joinDoc"}
+        assert await future == [None, ["line"], 3]
+        assert len(table) == 0
+
+        # unknown & already answered ids
+        assert table.resolve(msg_id, None) is None
+        assert table.resolve("999", None) is None
+    asyncio.run(run())
+
+def test_requests_timeout():
+    async def run():
+        table = protocol.RequestTable()
+        _, slow = table.add({}, timeout=0.01)
+        fast_id, fast = table.add({}, timeout=5)
+        with pytest.raises(asyncio.TimeoutError):
+            await slow
+        assert len(table) == 1
+        table.resolve(fast_id, "answer")
+        assert await fast == "answer"
+    asyncio.run(run())
+
+def test_requests_cancel():
+    async def run():
+        table = protocol.RequestTable()
+        futures = [table.add({}, timeout=5)[1] for _ in range(3)]
+        table.cancel(ConnectionError("lost"))
+        assert len(table) == 0
+        for future in futures:
+            with pytest.raises(ConnectionError):
+                await future
+    asyncio.run(run())
+
+def test_requests_bounded():
+    async def run():
+        table = protocol.RequestTable(max_size=3)
+        entries = [table.add({"n": n}) for n in range(5)]
+        assert len(table) == 3
+        for _, future in entries[:2]:
+            with pytest.raises(ConnectionError):
+                await future
+        assert table.resolve(entries[4][0], "last") == {"n": 4}
+        assert await entries[4][1] == "last"
+    asyncio.run(run())
+
+def test_requests_unawaited_failure():
+    # failed requests nobody waits for must not be reported as unhandled errors
+    async def run():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        table = protocol.RequestTable()
+        table.add({}, timeout=0)
+        table.add({})
+        table.cancel(ConnectionError("lost"))
+        await asyncio.sleep(0.01)
+        gc.collect()
+        assert errors == []
+    asyncio.run(run())
+
+@pytest.mark.parametrize("text, expected", [
+    ("abc123:60:60:websocket,xhr-polling", ("abc123", 60, ["websocket", "xhr-polling"])),
+    ("abc123::60:websocket\n", ("abc123", None, ["websocket"])),
+    ("abc123:25", ("abc123", 25, [])),
+])
+def test_parseHandshake(text, expected):
+    assert protocol.parseHandshake(text) == expected
@@ -0,0 +1,137 @@
+import random
+import asyncio
+import re
+from airlatex.prefetch import Prefetcher
+from airlatex.remotedocs import RemoteDocuments
+from airlatex.tree import ProjectIndex
+from airlatex.search import ProjectSearch
+
+
+class FakeProject:
+    """
+    Stand-in for AirLatexProject answering joinDoc & leaveDoc from a dict of texts.
+    """
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.joined = []
+        self.wait_for = 5
+        self.documents = {}
+        self.project = {"name": "Project"}
+        self.remote = RemoteDocuments(self)
+        self.prefetcher = Prefetcher(self)
+        self.index = ProjectIndex()
+        self.index.build({"_id": "root", "name": "rootFolder", "fileRefs": [], "folders": [],
+                          "docs": [{"_id": doc_id, "name": doc_id + ".tex"} for doc_id in texts]})
+
+    async def call(self, msg, timeout=None):
+        if msg["name"] == "leaveDoc":
+            return [None]
+        doc_id = msg["args"][0]
+        if len(msg["args"]) == 3:
+            return ["no updates"]
+        self.joined.append(doc_id)
+        return [None, self.texts[doc_id].split("\n"), 1, []]
+
+    async def fetchDocument(self, doc_id):
+        data = await self.call({"name": "joinDoc", "args": [doc_id, {}]})
+        return {"lines": data[1], "version": data[2]}
+
+
+def scanned(summary):
+    return int(re.search(r"of (\d+) document", summary).group(1))
+
+
+def test_candidates():
+    search = ProjectSearch(FakeProject({}), indexed=True)
+    search._reindex("a", "Hello World\nfoo bar")
+    search._reindex("b", "hello there")
+    search._reindex("c", "nothing")
+    assert search._candidates("hello") == {"a", "b"}
+    assert search._candidates("HELLO") == {"a", "b"}
+    assert search._candidates("lo wo") == {"a"}
+    assert search._candidates("d\nf") == {"a"}
+    assert search._candidates("missing") == set()
+    # too short for a trigram => all documents
+    assert search._candidates("he") is None
+
+    # changed & removed documents
+    search._reindex("b", "nothing")
+    assert search._candidates("hello") == {"a"}
+    assert search._candidates("nothing") == {"b", "c"}
+    search._reindex("c", None)
+    assert search._candidates("nothing") == {"b"}
+
+def test_candidates_superset():
+    rng = random.Random(0)
+    search = ProjectSearch(FakeProject({}), indexed=True)
+    texts = {}
+    for i in range(30):
+        texts[i] = "".join(rng.choice("abC \n") for _ in range(rng.randint(0, 60)))
+        search._reindex(i, texts[i])
+    for _ in range(500):
+        text = texts[rng.randrange(30)]
+        start = rng.randint(0, len(text))
+        query = text[start:start+rng.randint(3, 6)] if rng.random() < 0.7 else "".join(rng.choice("abc ") for _ in range(4))
+        if len(query) < 3:
+            continue
+        matching = {i for i, t in texts.items() if query.lower() in t.lower()}
+        assert matching <= search._candidates(query), query
+
+
+def test_grep_indexed():
+    texts = {
+        "main": "\\documentclass{article}\n\\input{intro}\nfoo bar",
+        "intro": "Hello World\nfoo  bar",
+        "notes": "nothing to see",
+    }
+    project = FakeProject(texts)
+    search = ProjectSearch(project, indexed=True)
+
+    async def grep(pattern):
+        results, summary = await search.grep(pattern)
+        return sorted((r["filename"], r["lnum"], r["col"]) for r in results), scanned(summary)
+
+    async def main():
+        # first search joins & indexes all documents
+        assert await grep("foo") == ([("Project/intro.tex", 2, 1), ("Project/main.tex", 3, 1)], 3)
+        assert sorted(project.joined) == ["intro", "main", "notes"]
+        assert sorted(search.trigrams) == ["intro", "main", "notes"]
+
+        # literal patterns (with spaces) only scan the candidates
+        assert await grep("foo bar") == ([("Project/main.tex", 3, 1)], 1)
+        assert await grep("see") == ([("Project/notes.tex", 1, 12)], 1)
+        assert await grep("missing") == ([], 0)
+
+        # lowercase patterns are case-insensitive, others are not
+        assert await grep("hello world") == ([("Project/intro.tex", 1, 1)], 1)
+        assert await grep("World") == ([("Project/intro.tex", 1, 7)], 1)
+        assert await grep("WORLD") == ([], 1)
+
+        # regular expressions scan all documents
+        assert await grep("foo +bar") == ([("Project/intro.tex", 2, 1), ("Project/main.tex", 3, 1)], 3)
+        assert await grep("\\\\input") == ([("Project/main.tex", 2, 1)], 3)
+        assert len(project.joined) == 3
+
+        # changed documents are indexed again at the next search
+        project.remote.applyUpdate({"doc": "notes", "op": [{"p": 0, "i": "foo bar "}], "v": 1})
+        assert search.dirty == {"notes"}
+        assert await grep("foo bar") == ([("Project/main.tex", 3, 1), ("Project/notes.tex", 1, 1)], 2)
+        assert not search.dirty
+        project.remote.applyUpdate({"doc": "main", "op": [{"p": 0, "d": "\\documentclass{article}\n\\input{intro}\nfoo bar"}], "v": 1})
+        assert await grep("foo bar") == ([("Project/notes.tex", 1, 1)], 1)
+        assert len(project.joined) == 3
+
+    asyncio.run(main())
+
+def test_grep_unindexed():
+    project = FakeProject({"main": "foo bar", "intro": "Foo Bar"})
+    search = ProjectSearch(project)
+
+    async def main():
+        results, summary = await search.grep("foo bar")
+        assert sorted(r["filename"] for r in results) == ["Project/intro.tex", "Project/main.tex"]
+        assert scanned(summary) == 2
+        assert not search.trigrams
+
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+import random
+from hashlib import sha1
+import pytest
+from airlatex.shadowdocument import Fenwick, ShadowDocument
+
+
+def randomLines(rng, n):
+    return ["".join(rng.choice("ab cä\\") for _ in range(rng.randint(0, 6))) for _ in range(n)]
+
+def gitHash(lines):
+    text = "\n".join(lines).encode()
+    return sha1(b"blob %i\x00" % len("\n".join(lines)) + text).hexdigest()
+
+def checkEqual(doc, lines):
+    assert len(doc) == len(lines)
+    assert list(doc) == lines
+    assert doc[:] == lines
+    assert doc.charCount() == len("\n".join(lines))
+    text = "\n".join(lines)
+    for line in range(len(lines)):
+        offset = doc.offset(line)
+        assert offset == sum(len(l)+1 for l in lines[:line])
+        assert doc.find(offset) == (line, 0)
+    for pos in range(len(text)+1):
+        line = text.count("\n", 0, pos)
+        assert doc.find(pos) == (line, pos - (text.rfind("\n", 0, pos) + 1))
+
+
+def test_fenwick():
+    values = [3, 0, 5, 1, 0, 2]
+    tree = Fenwick(values)
+    assert [tree.prefix(i) for i in range(len(values)+1)] == [0, 3, 3, 8, 9, 9, 11]
+    tree.add(1, 4)
+    assert tree.total == 15
+    assert tree.find(7) == (2, 0)
+    assert tree.find(6) == (1, 3)
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 512])
+def test_against_list(chunk_size):
+    rng = random.Random(chunk_size)
+    lines = randomLines(rng, rng.randint(1, 20))
+    doc = ShadowDocument(lines, chunk_size=chunk_size)
+    checkEqual(doc, lines)
+
+    for _ in range(300):
+        first = rng.randint(0, len(lines))
+        last = rng.randint(first, len(lines))
+        new = randomLines(rng, rng.randint(0, 7))
+
+        # keep at least one line (as a buffer does)
+        if first == 0 and last == len(lines) and not new:
+            new = [""]
+        if rng.random() < 0.5:
+            doc[first:last] = new
+        else:
+            doc.replace(first, last, new)
+        lines[first:last] = new
+        checkEqual(doc, lines)
+        assert doc.contentHash() == gitHash(lines)
+
+def test_item_access():
+    doc = ShadowDocument(["a", "b", "c"], chunk_size=1)
+    assert doc[0] == "a" and doc[-1] == "c"
+    assert doc[1:] == ["b", "c"]
+    assert doc[2:1] == []
+    doc[1] = "x"
+    doc[-1] = "y"
+    assert list(doc) == ["a", "x", "y"]
+    with pytest.raises(IndexError):
+        doc[3]
+
+def test_hash_cache_invalidated():
+    doc = ShadowDocument(["first", "second"])
+    before = doc.contentHash()
+    doc[0] = "changed"
+    assert doc.contentHash() != before
+    assert doc.contentHash() == gitHash(["changed", "second"])
@@ -0,0 +1,99 @@
+from airlatex.tree import fuzzyScore, ProjectIndex
+
+
+def folder(id, name, docs=(), fileRefs=(), folders=()):
+    return {"_id": id, "name": name, "docs": list(docs), "fileRefs": list(fileRefs), "folders": list(folders)}
+
+def entity(id, name):
+    return {"_id": id, "name": name}
+
+# rootFolder of joinProject:
+#   main.tex, refs.bib, chapters/{intro.tex, method.tex, figures/plot.png}
+def projectIndex():
+    figures = folder("figures", "figures", fileRefs=[entity("plot", "plot.png")])
+    chapters = folder("chapters", "chapters", docs=[entity("intro", "intro.tex"), entity("method", "method.tex")], folders=[figures])
+    root = folder("root", "rootFolder", docs=[entity("main", "main.tex"), entity("refs", "refs.bib")], folders=[chapters])
+    index = ProjectIndex()
+    index.build(root)
+    return index
+
+
+def test_build():
+    index = projectIndex()
+    assert index.path("main") == "main.tex"
+    assert index.path("intro") == "chapters/intro.tex"
+    assert index.path("plot") == "chapters/figures/plot.png"
+    assert index.byPath("/chapters/method.tex")["_id"] == "method"
+    assert index.byPath("chapters/figures/")["_id"] == "figures"
+    assert index.byPath("")["_id"] == "root"
+    assert sorted(e["_id"] for e in index.documents()) == ["intro", "main", "method", "refs"]
+    assert [e["_id"] for e in index.documents("fileRef")] == ["plot"]
+
+def test_chain():
+    index = projectIndex()
+    assert [e["_id"] for e in index.chain("plot")] == ["chapters", "figures", "plot"]
+    assert [e["_id"] for e in index.chain("main")] == ["main"]
+    assert index.chain("root") == []
+
+def test_rename():
+    index = projectIndex()
+    assert index.renameEntity("chapters", "parts")
+    assert index.path("intro") == "parts/intro.tex"
+    assert index.path("plot") == "parts/figures/plot.png"
+    assert index.byPath("chapters/intro.tex") is None
+    assert index.byPath("parts/intro.tex")["_id"] == "intro"
+    assert index.get("chapters")["name"] == "parts"
+    assert not index.renameEntity("root", "other")
+    assert not index.renameEntity("missing", "other")
+
+def test_move():
+    index = projectIndex()
+    assert index.moveEntity("figures", "root")
+    assert index.path("plot") == "figures/plot.png"
+    assert index.byPath("chapters/figures/plot.png") is None
+    assert [e["_id"] for e in index.chain("plot")] == ["figures", "plot"]
+    # the tree (shared with the sidebar) changes as well
+    assert index.get("chapters")["folders"] == []
+    assert [f["_id"] for f in index.get("root")["folders"]] == ["chapters", "figures"]
+
+    assert index.moveEntity("main", "chapters")
+    assert index.path("main") == "chapters/main.tex"
+    assert not index.moveEntity("main", "missing")
+    assert index.path("main") == "chapters/main.tex"
+
+def test_add_remove():
+    index = projectIndex()
+    assert index.addEntity("figures", entity("data", "data.csv"), "fileRef")
+    assert index.path("data") == "chapters/figures/data.csv"
+    assert not index.addEntity("missing", entity("other", "other.tex"), "file")
+
+    assert index.removeEntity("chapters")
+    for entity_id in ["chapters", "intro", "method", "figures", "plot", "data"]:
+        assert index.get(entity_id) is None
+    assert index.byPath("chapters/intro.tex") is None
+    assert index.get("root")["folders"] == []
+    assert sorted(e["_id"] for e in index.documents()) == ["main", "refs"]
+    assert not index.removeEntity("root")
+    assert not index.removeEntity("chapters")
+
+
+def test_fuzzy_score():
+    assert fuzzyScore("xyz", "main.tex") is None
+    assert fuzzyScore("mn", "main.tex") is not None
+    assert fuzzyScore("MAIN", "main.tex") == fuzzyScore("main", "main.tex")
+    # consecutive characters, matches in the file name & shorter paths win
+    assert fuzzyScore("intro", "chapters/intro.tex") > fuzzyScore("intro", "chapters/in_the_room.tex")
+    assert fuzzyScore("plot", "plot.png") > fuzzyScore("plot", "plots/other.png")
+    assert fuzzyScore("main", "main.tex") > fuzzyScore("main", "old/main.tex")
+
+def test_find():
+    index = projectIndex()
+    assert index.find("intro") == ["chapters/intro.tex"]
+    assert index.find("tex") == ["main.tex", "chapters/intro.tex", "chapters/method.tex"]
+    assert index.find("ctex")[0] == "chapters/intro.tex"
+    assert index.find("tex", limit=1) == ["main.tex"]
+    assert index.find("plot") == []
+    assert index.find("plot", type="fileRef") == ["chapters/figures/plot.png"]
+    assert index.find("chap", type="folder") == ["chapters", "chapters/figures"]
+    index.renameEntity("intro", "introduction.tex")
+    assert index.find("intro") == ["chapters/introduction.tex"]